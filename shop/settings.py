@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/4.1/ref/settings/
 """
 
+import os
 from pathlib import Path
 from django.utils.translation import gettext_lazy as _
 
@@ -52,6 +53,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'store.utils.GuestCartMiddleware',  # корзина гостя в подписанной cookie
 ]
 
 ROOT_URLCONF = 'shop.urls'
@@ -69,6 +71,7 @@ TEMPLATES = [
                 'django.template.context_processors.request',
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
+                'store.context_processors.favourite_products',
             ],
         },
     },
@@ -145,6 +148,22 @@ MEDIA_ROOT = BASE_DIR / 'media'
 
 
 
+# Cache
+# https://docs.djangoproject.com/en/4.1/topics/cache/
+# Для нескольких процессов нужен общий кеш, например
+# 'django.core.cache.backends.filebased.FileBasedCache' с LOCATION=BASE_DIR / 'cache'
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'totembo',
+        'OPTIONS': {
+            'MAX_ENTRIES': 10000,  # по умолчанию 300 - меньше, чем карточек товаров в каталоге
+        },
+    }
+}
+
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/4.1/ref/settings/#default-auto-field
 
@@ -164,6 +183,12 @@ STRIPE_PUBLIC_KEY = 'pk_test_51KniXYAxRYRPHE83bbfdE4ksfdYA2pF8frneghPJUbP2CDE8ti
 
 STRIPE_SECRET_KEY = "sk_test_51KniXYAxRYRPHE83AnQt699xPMqf2yp8jmPl1qY1WhdG5AW7mFyKqLrGjsakvGO5KWb6VQBhCrXW0w3pq2ChmlGp0027FjhCDL"
 
+# Секрет подписи вебхука (whsec_...) из панели Stripe, без него вебхук отклоняет события
+STRIPE_WEBHOOK_SECRET = os.environ.get('STRIPE_WEBHOOK_SECRET', '')
+
+# Токен склада для API остатков и цен (Authorization: Bearer ...), без него API закрыт
+WAREHOUSE_API_TOKEN = os.environ.get('WAREHOUSE_API_TOKEN', '')
+
 
 
 
@@ -1,7 +1,9 @@
 from django.contrib import admin
 from .models import *
+from django.db.models import Count
 from django.utils.safestring import mark_safe
 from modeltranslation.admin import TranslationAdmin
+from .facets import FACETS
 # Register your models here.
 
 class GalleryInline(admin.TabularInline):
@@ -10,18 +12,33 @@ class GalleryInline(admin.TabularInline):
     extra = 1
 
 
+class PriceFilter(admin.SimpleListFilter):  # диапазоны цен как на странице категории, без SELECT DISTINCT price
+    title = 'Цена'
+    parameter_name = 'price_range'
+    facet = next(facet for facet in FACETS if facet.param == 'price')
+
+    def lookups(self, request, model_admin):
+        return [(self.facet.get_key(low, high), title) for low, high, title in self.facet.ranges]
+
+    def queryset(self, request, queryset):
+        if self.value():
+            return queryset.filter(self.facet.get_q([self.value()]))
+
+
 @admin.register(Category)
 class CategoryAdmin(admin.ModelAdmin):
     list_display = ('title', 'parent', 'get_products_count')
+    list_select_related = ('parent',)
     prepopulated_fields = {'slug': ('title',)}
 
+    def get_queryset(self, request):  # количество товаров считает сама база одним запросом
+        return super().get_queryset(request).annotate(products_count=Count('products'))
+
     def get_products_count(self, obj):
-        if obj.products:
-            return str(len(obj.products.all()))
-        else:
-            return '0'
+        return obj.products_count
 
     get_products_count.short_description = 'Количество товаров'
+    get_products_count.admin_order_field = 'products_count'
 
 
 @admin.register(Product)
@@ -29,21 +46,49 @@ class ProductAdmin(TranslationAdmin):
     list_display = ('pk', 'title', 'category', 'quantity', 'price', 'created_at', 'size', 'color', 'get_photo')
     list_editable = ('price', 'quantity', 'size', 'color')
     list_display_links = ('title',)
+    list_select_related = ('category',)
     prepopulated_fields = {'slug': ('title',)}
-    list_filter = ('title', 'price')
+    list_filter = ('category', PriceFilter)  # категория и цена вместе идут по индексу product_category_price_idx
     inlines = [GalleryInline]
 
-    def get_photo(self, obj):
-        if obj.images:
-            try:
-                return mark_safe(f'<img src="{obj.images.all()[0].image.url}" width="75">')
-            except:
-                return '-'
+    def get_photo(self, obj):  # миниатюра хранится в товаре, запросов к галерее нет
+        if obj.thumbnail_url:
+            return mark_safe(f'<img src="{obj.thumbnail_url}" width="75">')
         else:
             return '-'
 
     get_photo.short_description = 'Фото товара'
 
+@admin.register(MailCampaign)
+class MailCampaignAdmin(admin.ModelAdmin):
+    list_display = ('pk', 'subject', 'status', 'total', 'sent', 'failed', 'created_at', 'finished_at')
+    readonly_fields = ('status', 'total', 'sent', 'failed', 'finished_at', 'heartbeat_at')
+
+
+@admin.register(ArchivedOrder)
+class ArchivedOrderAdmin(admin.ModelAdmin):  # архив только для просмотра, снимок заказа не меняется
+    list_display = ('order_id', 'customer', 'total', 'total_quantity', 'paid_at')
+    list_select_related = ('customer',)
+    readonly_fields = [field.name for field in ArchivedOrder._meta.fields]
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+
+@admin.register(CheckoutSession)
+class CheckoutSessionAdmin(admin.ModelAdmin):  # оплаты со статусом review разбирает менеджер
+    list_display = ('session_id', 'order_id', 'customer', 'total_cents', 'amount_paid_cents', 'status', 'paid_at')
+    list_filter = ('status',)
+    list_select_related = ('customer',)
+    readonly_fields = [field.name for field in CheckoutSession._meta.fields if field.name not in ('status', 'note')]
+
+    def has_add_permission(self, request):
+        return False
+
+
 @admin.register(Review)
 class ReviewAdmin(admin.ModelAdmin):
     list_display = ('pk', 'author', 'text', 'created_at')
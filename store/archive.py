@@ -0,0 +1,64 @@
+from django.db import transaction
+
+from .models import ArchivedOrder, Order, OrderProduct, ShippingAddress
+
+# Оплаченные заказы уходят из рабочих таблиц Order/OrderProduct в ArchivedOrder:
+# товары с ценой на момент покупки и адрес доставки хранятся одной строкой в JSON,
+# поэтому поиск открытой корзины и её итоги не зависят от истории заказов покупателя
+
+
+def freeze_items(lines):  # строки заказа с ценами на этот момент
+    return [{
+        'product_id': line.product_id,
+        'title': line.product.title,
+        'price_cents': line.product.price_cents,
+        'quantity': line.quantity,
+    } for line in lines if line.product and line.quantity]
+
+
+def freeze_order(order, items, address=None):
+    shipping = None
+    if address:
+        shipping = {'address': address.address, 'city': str(address.city), 'region': address.region,
+                    'phone': address.phone}
+    return ArchivedOrder(
+        order_id=order.pk,
+        customer_id=order.customer_id,
+        created_at=order.created_at,
+        paid_at=order.paid_at,
+        stripe_session_id=order.stripe_session_id,
+        total_cents=sum(item['price_cents'] * item['quantity'] for item in items),
+        total_quantity=sum(item['quantity'] for item in items),
+        items=items,
+        shipping=shipping,
+    )
+
+
+def archive_order(order, items):  # вызывается в транзакции вебхука сразу после оплаты, items - оплаченный снимок
+    with transaction.atomic():
+        address = ShippingAddress.objects.filter(order=order).select_related('city').order_by('-pk').first()
+        archived = freeze_order(order, items, address)
+        archived.save()
+        OrderProduct.objects.filter(order=order).delete()
+        order.delete()  # адреса доставки остаются, ссылка на заказ обнуляется (SET_NULL)
+    return archived
+
+
+def archive_completed_orders(batch_size=500):  # для закрытых заказов, оставшихся в рабочих таблицах
+    archived = 0
+    while True:
+        orders = list(Order.objects.filter(is_completed=True).order_by('pk')[:batch_size])
+        if not orders:
+            return archived
+        lines, addresses = {}, {}
+        for line in OrderProduct.objects.filter(order__in=orders).select_related('product'):
+            lines.setdefault(line.order_id, []).append(line)
+        for address in ShippingAddress.objects.filter(order__in=orders).select_related('city').order_by('pk'):
+            addresses[address.order_id] = address  # последний адрес заказа
+        with transaction.atomic():
+            ArchivedOrder.objects.bulk_create([freeze_order(order, freeze_items(lines.get(order.pk, [])),
+                                                            addresses.get(order.pk))
+                                               for order in orders], ignore_conflicts=True)
+            OrderProduct.objects.filter(order__in=orders).delete()
+            Order.objects.filter(pk__in=[order.pk for order in orders]).delete()
+        archived += len(orders)
@@ -0,0 +1,107 @@
+import threading
+from bisect import bisect_left, insort
+
+from .models import Product
+from .catalog import get_generation, bump_generation
+
+# Подсказки поиска по мере ввода: отсортированные массивы названий (ru и en) в памяти процесса.
+# Индекс строится при первом запросе, дальше обновляется сигналами Product. Номер поколения
+# в общем кеше сообщает другим процессам, что их копия устарела и её надо перестроить
+
+AUTOCOMPLETE_GENERATION_KEY = 'store:autocomplete:generation'
+LANGUAGES = ('ru', 'en')
+
+
+def normalize(title):
+    return ' '.join((title or '').casefold().replace('ё', 'е').split())
+
+
+class PrefixIndex:
+    def __init__(self):
+        self.keys = {language: [] for language in LANGUAGES}  # [(нормализованное название, pk)]
+        self.products = {}  # pk -> (slug, {язык: название})
+        self.generation = None
+        self.lock = threading.Lock()
+
+    def _remove(self, pk):
+        slug, titles = self.products.pop(pk, (None, {}))
+        for language, title in titles.items():
+            keys = self.keys[language]
+            position = bisect_left(keys, (normalize(title), pk))
+            if position < len(keys) and keys[position] == (normalize(title), pk):
+                del keys[position]
+
+    def update(self, pk, slug, titles):
+        titles = {language: title for language, title in titles.items() if title}
+        with self.lock:
+            self._remove(pk)
+            self.products[pk] = (slug, titles)
+            for language, title in titles.items():
+                insort(self.keys[language], (normalize(title), pk))
+
+    def remove(self, pk):
+        with self.lock:
+            self._remove(pk)
+
+    def build(self, rows, generation=None):
+        keys = {language: [] for language in LANGUAGES}
+        products = {}
+        for pk, slug, title_ru, title_en in rows:
+            titles = {language: title for language, title in zip(LANGUAGES, (title_ru, title_en)) if title}
+            products[pk] = (slug, titles)
+            for language, title in titles.items():
+                keys[language].append((normalize(title), pk))
+        for language_keys in keys.values():
+            language_keys.sort()
+        with self.lock:
+            self.keys, self.products, self.generation = keys, products, generation
+
+    def search(self, prefix, language='ru', limit=10):
+        prefix = normalize(prefix)
+        if not prefix:
+            return []
+        found = []
+        # под той же блокировкой, что и update(): на многопоточном сервере товар могут переименовать
+        # прямо во время поиска. Поиск - bisect и не больше limit шагов, блокировка держится недолго
+        with self.lock:
+            # сначала названия на текущем языке, потом добираем из второго
+            for lang in sorted(LANGUAGES, key=lambda item: item != language):
+                keys = self.keys[lang]
+                position = bisect_left(keys, (prefix,))
+                while position < len(keys) and len(found) < limit and keys[position][0].startswith(prefix):
+                    pk = keys[position][1]
+                    if pk not in found:
+                        found.append(pk)
+                    position += 1
+            return [(pk, *self.products[pk]) for pk in found]
+
+
+index = PrefixIndex()
+
+
+def get_index():
+    generation = get_generation(AUTOCOMPLETE_GENERATION_KEY)
+    if index.generation != generation:  # первый запрос в процессе или товары меняли в другом процессе
+        rows = Product.objects.values_list('pk', 'slug', 'title_ru', 'title_en').iterator(chunk_size=5000)
+        index.build(rows, generation)
+    return index
+
+
+def sync_generation(known):
+    generation = bump_generation(AUTOCOMPLETE_GENERATION_KEY)
+    if known is not None and generation == known + 1:  # кроме нас товары никто не менял - копия актуальна
+        index.generation = generation
+
+
+def product_changed(product):
+    known = index.generation
+    if known is not None:
+        index.update(product.pk, product.slug, {'ru': product.title_ru or product.title, 'en': product.title_en})
+    sync_generation(known)
+
+
+def product_deleted(pk):
+    known = index.generation
+    if known is not None:
+        index.remove(pk)
+    sync_generation(known)
@@ -0,0 +1,165 @@
+import random
+import time
+
+from django.core.cache import cache
+from django.db import connection
+from django.db.models import Prefetch
+from django.utils import timezone
+from .models import Category, Product, Gallery
+from .thumbnails import get_photo_fields
+
+
+# Дерево каталога для главной страницы: категории -> подкатегории -> товары.
+# Всё дерево собирается за фиксированное число запросов, сколько бы ни было товаров,
+# фото карточек уже лежат в самих товарах (photo_url, thumbnail_url)
+def get_catalog_tree():
+    subcategories = Category.objects.prefetch_related('products')
+    return Category.objects.filter(parent=None).prefetch_related(
+        Prefetch('subcategories', queryset=subcategories)
+    )
+
+
+# ----------------------------------------------------------------------------------------
+# Кеш дерева категорий для шапки, главной и карусели.
+# Ключ содержит номер поколения: сигналы Category увеличивают его, и все процессы,
+# работающие с общим кешем (файловым, memcached...), сразу перестают видеть старое дерево
+
+CATEGORY_GENERATION_KEY = 'store:categories:generation'
+CATEGORY_TREE_TIMEOUT = 60 * 60 * 24
+
+category_cache_stats = {'hits': 0, 'misses': 0}
+
+
+def get_generation(key):
+    generation = cache.get(key)
+    if generation is None:
+        # Начинаем с метки времени, чтобы не совпасть с поколением, вытесненным из кеша
+        cache.add(key, time.time_ns(), timeout=None)
+        generation = cache.get(key)
+    return generation
+
+
+def bump_generation(key):
+    try:
+        return cache.incr(key)
+    except ValueError:  # ключа нет в кеше
+        cache.add(key, time.time_ns(), timeout=None)
+        return cache.get(key)
+
+
+def get_category_generation():
+    return get_generation(CATEGORY_GENERATION_KEY)
+
+
+def bump_category_generation():
+    return bump_generation(CATEGORY_GENERATION_KEY)
+
+
+def build_category_tree():
+    tree = {'roots': [], 'children': {}}
+    for category in Category.objects.order_by('pk'):
+        if category.parent_id is None:
+            tree['roots'].append(category)
+        else:
+            tree['children'].setdefault(category.parent_id, []).append(category)
+    return tree
+
+
+def get_category_tree():
+    key = f'store:categories:tree:{get_category_generation()}'
+    tree = cache.get(key)
+    if tree is None:
+        category_cache_stats['misses'] += 1
+        tree = build_category_tree()
+        cache.set(key, tree, CATEGORY_TREE_TIMEOUT)
+    else:
+        category_cache_stats['hits'] += 1
+    return tree
+
+
+def get_category_cache_stats():  # статистика попаданий текущего процесса
+    hits, misses = category_cache_stats['hits'], category_cache_stats['misses']
+    total = hits + misses
+    return {
+        'hits': hits,
+        'misses': misses,
+        'hit_rate': hits / total if total else 0.0,
+    }
+
+
+def reset_category_cache_stats():
+    category_cache_stats['hits'] = 0
+    category_cache_stats['misses'] = 0
+
+
+
+# ----------------------------------------------------------------------------------------
+# Рекомендации "You may also like": случайные товары той же категории.
+# Пул id - случайная выборка из категории ограниченного размера, лежит в кеше и по истечении
+# RELATED_POOL_TIMEOUT собирается заново, так что в большой категории со временем показываются все товары
+
+RELATED_POOL_SIZE = 200
+RELATED_POOL_TIMEOUT = 60 * 60
+
+
+def get_related_pool_key(category_id):
+    return f'store:related:pool:{category_id}'
+
+
+def get_related_pool(category_id):
+    key = get_related_pool_key(category_id)
+    pool = cache.get(key)
+    if pool is None:
+        pool = list(Product.objects.filter(category_id=category_id)
+                    .order_by('?').values_list('pk', flat=True)[:RELATED_POOL_SIZE])
+        cache.set(key, pool, RELATED_POOL_TIMEOUT)
+    return pool
+
+
+def get_related_products(product, count=4, seed=None):  # не больше двух запросов: пул и сами товары
+    pool = [pk for pk in get_related_pool(product.category_id) if pk != product.pk]
+    ids = random.Random(seed).sample(pool, min(count, len(pool)))
+    if not ids:
+        return []
+    products = Product.objects.in_bulk(ids)
+    return [products[pk] for pk in ids if pk in products]
+
+
+# ----------------------------------------------------------------------------------------
+# Массовое обновление строк. bulk_update собирает на каждое поле CASE WHEN по всем id пачки:
+# на тысячах товаров и Django, и SQLite тратят на это секунды. Один UPDATE ... WHERE id = %s
+# через executemany обновляет ту же пачку за один проход
+
+def update_rows(objs, fields):
+    if not objs:
+        return
+    meta = type(objs[0])._meta
+    fields = [meta.get_field(name) for name in fields]
+    quote = connection.ops.quote_name
+    sql = (f"UPDATE {quote(meta.db_table)} SET {', '.join(f'{quote(field.column)} = %s' for field in fields)} "
+           f"WHERE {quote(meta.pk.column)} = %s")
+    with connection.cursor() as cursor:
+        cursor.executemany(sql, [
+            [field.get_db_prep_save(getattr(obj, field.attname), connection) for field in fields] + [obj.pk]
+            for obj in objs
+        ])
+
+
+# ----------------------------------------------------------------------------------------
+# Первое фото товара хранится в Product, чтобы списки товаров не ходили в Gallery.
+# Обновляется сигналами Gallery; массовые правки фото вызывают refresh_product_photos сами
+
+PHOTO_FIELDS = ['photo_url', 'thumbnail_url', 'photo_srcset']
+
+
+def refresh_product_photos(product_ids, batch_size=500):
+    product_ids = list(product_ids)
+    for start in range(0, len(product_ids), batch_size):
+        batch = product_ids[start:start + batch_size]
+        first_images = {}
+        rows = Gallery.objects.filter(product_id__in=batch).order_by('product_id', 'pk').values_list('product_id', 'image')
+        for product_id, image in rows:
+            first_images.setdefault(product_id, image)
+        now = timezone.now()  # новая версия кеша карточки
+        products = [Product(pk=pk, updated_at=now, **get_photo_fields(first_images.get(pk))) for pk in batch]
+        update_rows(products, PHOTO_FIELDS + ['updated_at'])
@@ -0,0 +1,21 @@
+from django.utils.functional import SimpleLazyObject
+from .models import FavoriteProducts
+
+
+def get_favourite_ids(request):
+    # Один запрос на весь запрос пользователя, результат запоминаем на объекте request
+    if not hasattr(request, '_favourite_product_ids'):
+        user = getattr(request, 'user', None)
+        if user is not None and user.is_authenticated:
+            ids = FavoriteProducts.objects.filter(user=user).values_list('product_id', flat=True)
+            request._favourite_product_ids = frozenset(ids)
+        else:
+            request._favourite_product_ids = frozenset()
+    return request._favourite_product_ids
+
+
+def favourite_products(request):
+    # Ленивый объект: страницы без карточек товаров не делают запрос вовсе
+    return {
+        'fav_product_ids': SimpleLazyObject(lambda: get_favourite_ids(request))
+    }
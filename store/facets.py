@@ -0,0 +1,129 @@
+from django.db.models import Case, Count, IntegerField, Q, Value, When
+
+# Фильтры страницы категории (цена, цвет/материал, размер, наличие) со счётчиками у каждого варианта.
+# Счётчики одного фасета - один GROUP BY по товарам, отфильтрованным всеми остальными фасетами,
+# поэтому выбранный цвет не обнуляет соседние цвета, а варианты цены показывают, сколько их с этим цветом
+
+
+class RangeFacet:
+    def __init__(self, param, field, title, ranges):
+        self.param = param
+        self.field = field
+        self.title = title
+        self.ranges = ranges  # [(от, до, подпись)], границы идут по возрастанию
+
+    def get_key(self, low, high):
+        return f'{low or ""}-{high or ""}'
+
+    def get_q(self, values):
+        q = Q()
+        for low, high, title in self.ranges:
+            if self.get_key(low, high) in values:
+                bounds = {}
+                if low is not None:
+                    bounds[f'{self.field}__gte'] = low
+                if high is not None:
+                    bounds[f'{self.field}__lt'] = high
+                q |= Q(**bounds)
+        return q
+
+    def get_counts(self, queryset):
+        whens = [When(**{f'{self.field}__lt': high}, then=Value(i))
+                 for i, (low, high, title) in enumerate(self.ranges) if high is not None]
+        bucket = Case(*whens, default=Value(len(self.ranges) - 1), output_field=IntegerField())
+        rows = queryset.annotate(bucket=bucket).values('bucket').annotate(count=Count('pk')).order_by()
+        counts = {row['bucket']: row['count'] for row in rows}
+        return [(self.get_key(low, high), title, counts.get(i, 0))
+                for i, (low, high, title) in enumerate(self.ranges)]
+
+
+class ValueFacet:
+    def __init__(self, param, field, title):
+        self.param = param
+        self.field = field
+        self.title = title
+
+    def get_q(self, values):
+        return Q(**{f'{self.field}__in': values})
+
+    def get_counts(self, queryset):
+        rows = queryset.values(self.field).annotate(count=Count('pk')).order_by(self.field)
+        return [(row[self.field], row[self.field], row['count']) for row in rows]
+
+
+class StockFacet:
+    param = 'in_stock'
+    title = 'Наличие'
+
+    def get_q(self, values):
+        return Q(quantity__gt=0)
+
+    def get_counts(self, queryset):
+        count = queryset.aggregate(count=Count('pk', filter=Q(quantity__gt=0)))['count']
+        return [('1', 'Только в наличии', count)]
+
+
+FACETS = [
+    RangeFacet('price', 'price', 'Цена', [
+        (None, 1000, 'До 1 000'),
+        (1000, 5000, '1 000 - 5 000'),
+        (5000, 20000, '5 000 - 20 000'),
+        (20000, None, 'От 20 000'),
+    ]),
+    ValueFacet('color', 'color', 'Цвет/Материал'),
+    RangeFacet('size', 'size', 'Размер', [
+        (None, 30, 'До 30 мм'),
+        (30, 40, '30 - 40 мм'),
+        (40, None, 'От 40 мм'),
+    ]),
+    StockFacet(),
+]
+
+
+def get_query(params, param, value, toggle=True):
+    # Ссылка варианта: включает/выключает значение и сбрасывает курсор страницы
+    params = params.copy()
+    params.pop('cursor', None)
+    params.pop('page', None)
+    values = params.getlist(param)
+    if not toggle:
+        values = [value]
+    elif value in values:
+        values.remove(value)
+    else:
+        values.append(value)
+    params.setlist(param, values)
+    return params.urlencode()
+
+
+class FacetFilter:
+    def __init__(self, params, facets=FACETS):
+        self.params = params
+        self.facets = facets
+        self.selected = {facet.param: [value for value in params.getlist(facet.param) if value]
+                         for facet in facets}
+
+    def get_q(self, exclude=None):
+        q = Q()
+        for facet in self.facets:
+            if facet is not exclude and self.selected[facet.param]:
+                q &= facet.get_q(self.selected[facet.param])
+        return q
+
+    def filter(self, queryset):
+        return queryset.filter(self.get_q())
+
+    def describe(self, queryset):
+        # Описание фасетов для шаблона: по одному запросу на фасет
+        description = []
+        for facet in self.facets:
+            selected = self.selected[facet.param]
+            options = [{
+                'value': value,
+                'title': title,
+                'count': count,
+                'selected': str(value) in selected,
+                'query': get_query(self.params, facet.param, str(value)),
+            } for value, title, count in facet.get_counts(queryset.filter(self.get_q(exclude=facet)))]
+            description.append({'title': facet.title, 'param': facet.param, 'options': options})
+        return description
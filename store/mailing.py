@@ -0,0 +1,106 @@
+import smtplib
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.db.models import Q
+from django.utils import timezone
+from .models import Mail, MailCampaign
+
+# Рассылка по подписчикам вне HTTP-запроса: вьюшка только ставит рассылку в очередь,
+# воркер отправляет письма пачками, по одному SMTP-соединению на пачку. Воркер сначала захватывает
+# рассылку условным UPDATE и отмечается (heartbeat_at) после каждой пачки: второй воркер (cron рядом
+# с --loop) её не тронет, пока отметка не устарела, то есть пока первый воркер жив
+
+BATCH_SIZE = getattr(settings, 'MAIL_CAMPAIGN_BATCH_SIZE', 100)
+BATCH_DELAY = getattr(settings, 'MAIL_CAMPAIGN_BATCH_DELAY', 1.0)  # пауза между пачками, чтобы не упереться в лимиты SMTP
+RETRIES = getattr(settings, 'MAIL_CAMPAIGN_RETRIES', 3)
+# рассылку, от воркера которой так долго нет отметок, можно продолжить: он упал или завис
+LOCK_TIMEOUT = timedelta(seconds=getattr(settings, 'MAIL_CAMPAIGN_LOCK_TIMEOUT', 600))
+
+
+def queue_campaign(text, subject=None):
+    campaign = MailCampaign(text=text, total=Mail.objects.count())
+    if subject:
+        campaign.subject = subject
+    campaign.save()
+    return campaign
+
+
+def send_batch(messages, retries=RETRIES, delay=BATCH_DELAY):
+    # Письма пачки уходят по одному через одно соединение. Отклонённый адрес - ошибка только его письма,
+    # такое письмо не повторяем. При обрыве соединения ждём и повторяем лишь неотправленный остаток пачки
+    sent = position = 0
+    for attempt in range(retries + 1):
+        try:
+            with get_connection() as connection:
+                while position < len(messages):
+                    try:
+                        sent += connection.send_messages([messages[position]]) or 0
+                    except smtplib.SMTPRecipientsRefused:
+                        pass  # адрес не принят сервером - письмо в failed
+                    position += 1
+            return sent
+        except (smtplib.SMTPException, OSError):
+            if attempt == retries:
+                return sent
+            time.sleep(delay * 2 ** attempt)
+
+
+def iter_subscribers(chunk_size=BATCH_SIZE, after=0):
+    # Подписчики пачками по pk (keyset): в памяти всегда не больше одной пачки,
+    # а каждая следующая выборка идёт по индексу первичного ключа без OFFSET
+    while True:
+        chunk = list(Mail.objects.filter(pk__gt=after).order_by('pk').values_list('pk', 'mail')[:chunk_size])
+        if not chunk:
+            return
+        yield chunk
+        after = chunk[-1][0]
+
+
+def claim_campaign(campaign):
+    now = timezone.now()
+    # 'sending' без свежей отметки - рассылка, прерванная остановкой воркера: продолжаем с last_mail_id
+    available = Q(status='queued') | Q(status='sending', heartbeat_at=None) | \
+        Q(status='sending', heartbeat_at__lt=now - LOCK_TIMEOUT)
+    if not MailCampaign.objects.filter(available, pk=campaign.pk).update(status='sending', heartbeat_at=now):
+        return False  # рассылку уже отправляет другой воркер
+    campaign.status, campaign.heartbeat_at = 'sending', now
+    return True
+
+
+def send_campaign(campaign, batch_size=BATCH_SIZE, delay=BATCH_DELAY, retries=RETRIES):
+    if not claim_campaign(campaign):
+        return None
+
+    for number, batch in enumerate(iter_subscribers(batch_size, after=campaign.last_mail_id)):
+        if number and delay:
+            time.sleep(delay)
+        messages = [EmailMessage(campaign.subject, campaign.text, settings.EMAIL_HOST_USER, [address])
+                    for pk, address in batch]
+        sent = send_batch(messages, retries=retries, delay=delay)
+        campaign.sent += sent
+        campaign.failed += len(batch) - sent
+        campaign.last_mail_id = batch[-1][0]
+        # прогресс виден на странице рассылки и в админке; если нашу отметку сменил другой воркер,
+        # значит рассылку сочли брошенной и продолжили - останавливаемся
+        now = timezone.now()
+        if not MailCampaign.objects.filter(pk=campaign.pk, heartbeat_at=campaign.heartbeat_at).update(
+                sent=campaign.sent, failed=campaign.failed, last_mail_id=campaign.last_mail_id, heartbeat_at=now):
+            return None
+        campaign.heartbeat_at = now
+
+    campaign.status = 'done'
+    campaign.finished_at = timezone.now()
+    campaign.save(update_fields=['status', 'finished_at'])
+    return campaign
+
+
+def send_queued_campaigns(**options):
+    campaigns = []
+    for campaign in MailCampaign.objects.filter(status__in=['sending', 'queued']).order_by('pk'):
+        campaign = send_campaign(campaign, **options)
+        if campaign:
+            campaigns.append(campaign)
+    return campaigns
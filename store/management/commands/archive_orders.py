@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from store.archive import archive_completed_orders
+
+
+class Command(BaseCommand):
+    help = 'Переносит закрытые заказы из рабочих таблиц в архив'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        archived = archive_completed_orders(options['batch_size'])
+        self.stdout.write(f'Заказов перенесено в архив: {archived}')
@@ -0,0 +1,264 @@
+import json
+import os
+import random
+import re
+import shutil
+import statistics
+import tempfile
+import time
+import tracemalloc
+
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.db.models import Value
+from django.db.models.functions import Concat
+from django.template import Template, RequestContext
+from django.test import RequestFactory, override_settings
+from django.test.utils import CaptureQueriesContext
+
+from store.catalog import refresh_product_photos
+from store.models import Category, Product, Gallery, Mail, Customer, Order, OrderProduct
+from store.management.commands.export_mails import export_mails
+from store.management.commands.export_catalog import export_catalog
+from store.management.commands.import_catalog import import_catalog
+from store.search import SearchResults, rebuild_index
+from store.autocomplete import PrefixIndex
+from store.payments import get_cart_snapshot, build_line_items
+from store.stock import apply_stock_updates
+
+
+# Замеры производительности на временных данных: всё, что создаёт замер,
+# откатывается в конце транзакции, рабочая база не меняется
+
+WORDS_RU = ['золотые', 'серебряные', 'часы', 'кольцо', 'цепь', 'браслет', 'серьги', 'кварцевые',
+            'механические', 'классические', 'спортивные', 'платиновый', 'подвеска', 'женские', 'мужские']
+WORDS_EN = ['gold', 'silver', 'watch', 'ring', 'chain', 'bracelet', 'earrings', 'quartz',
+            'mechanical', 'classic', 'sport', 'platinum', 'pendant', 'women', 'men']
+
+
+def create_products(size, prefix='bench'):
+    category = Category.objects.create(title=prefix, slug=prefix)
+    subcategory = Category.objects.create(title=f'{prefix}-sub', slug=f'{prefix}-sub', parent=category)
+    rnd = random.Random(0)
+    products = []
+    for i in range(size):
+        words = rnd.sample(range(len(WORDS_RU)), 3)
+        title_ru = ' '.join(WORDS_RU[w] for w in words) + f' {i}'
+        title_en = ' '.join(WORDS_EN[w] for w in words) + f' {i}'
+        products.append(Product(title=title_ru, title_ru=title_ru, title_en=title_en, slug=f'{prefix}-{i}',
+                                price=100 + i % 50, quantity=i % 3, color=WORDS_RU[words[0]], category=subcategory))
+    products = Product.objects.bulk_create(products, batch_size=2000)
+    Gallery.objects.bulk_create([Gallery(product=p, image=f'products/{p.slug}.png') for p in products], batch_size=2000)
+    Product.objects.filter(category=subcategory).update(photo_url=Concat(Value('/media/products/'), 'slug', Value('.png')))
+    return subcategory
+
+
+def render_cards(products, request):
+    template = Template("{% for product in products %}{% include 'store/components/_product_card.html' %}{% endfor %}")
+    return template.render(RequestContext(request, {'products': products}))
+
+
+def bench_cards(command, size):
+    category = create_products(size)
+    products = list(category.products.all())  # как в избранном и рекомендациях
+    request = RequestFactory().get('/')
+    request.user = AnonymousUser()
+
+    cache.clear()
+    started = time.perf_counter()
+    render_cards(products, request)
+    cold = time.perf_counter() - started
+
+    started = time.perf_counter()
+    render_cards(products, request)
+    warm = time.perf_counter() - started
+
+    command.stdout.write(f'{size} карточек: холодный кеш {cold * 1000:.1f} мс, '
+                         f'тёплый кеш {warm * 1000:.1f} мс, ускорение x{cold / warm:.1f}')
+
+
+def measure_peak(function):
+    tracemalloc.start()
+    started = time.perf_counter()
+    function()
+    elapsed = time.perf_counter() - started
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return elapsed, peak
+
+
+def bench_export(command, size):
+    Mail.objects.bulk_create([Mail(mail=f'subscriber{i}@example.com') for i in range(size)], batch_size=5000)
+
+    def load_all(stream):  # как раньше: все подписчики списком в памяти
+        for mail in list(Mail.objects.all()):
+            stream.write(f'{mail.pk},{mail.mail}\r\n')
+
+    for title, export in [('Mail.objects.all()', load_all), ('export_mails', export_mails)]:
+        with open(os.devnull, 'w') as stream:
+            elapsed, peak = measure_peak(lambda: export(stream))
+        command.stdout.write(f'{title}: {size} адресов за {elapsed:.2f} с, пик памяти {peak / 2 ** 20:.1f} МБ')
+
+
+def bench_search(command, size):
+    create_products(size)
+    rebuild_index()
+    timings = {}
+    for query in ['зол', 'часы', 'серебр цеп', 'gold', 'mech wat', 'platinum pend', 'кварц', '12345']:
+        runs = []
+        for _ in range(5):  # как страница поиска: count() для пагинатора и первые 12 товаров
+            started = time.perf_counter()
+            results = SearchResults(query)
+            results.count()
+            results[:12]
+            runs.append((time.perf_counter() - started) * 1000)
+        timings[query] = statistics.median(runs)
+        command.stdout.write(f'{query!r}: {timings[query]:.1f} мс (медиана 5 запросов, первый {runs[0]:.1f} мс)')
+    command.stdout.write(f'{size} товаров: среднее {sum(timings.values()) / len(timings):.1f} мс, '
+                         f'максимум {max(timings.values()):.1f} мс')
+
+
+def bench_autocomplete(command, size):
+    create_products(size)
+    index = PrefixIndex()
+    rows = list(Product.objects.values_list('pk', 'slug', 'title_ru', 'title_en'))
+    elapsed, peak = measure_peak(lambda: index.build(rows))
+    command.stdout.write(f'{size} товаров: индекс построен за {elapsed:.2f} с, пик памяти {peak / 2 ** 20:.1f} МБ')
+
+    queries = ['з', 'зол', 'золотые час', 'g', 'gold', 'platinum pend', 'кварц', 'нет такого']
+    started = time.perf_counter()
+    for _ in range(100):
+        for query in queries:
+            index.search(query, 'ru')
+    elapsed = (time.perf_counter() - started) / (100 * len(queries))
+    command.stdout.write(f'подсказка в среднем за {elapsed * 1000:.3f} мс')
+
+
+def bench_images(command, size):
+    # Сколько байт картинок скачает браузер за страницу карточек: исходные PNG против srcset
+    source = settings.MEDIA_ROOT / 'products'
+    originals = sorted(os.listdir(source))
+    with tempfile.TemporaryDirectory() as media, override_settings(MEDIA_ROOT=media):
+        shutil.copytree(source, os.path.join(media, 'products'))
+        category = create_products(size)
+        Gallery.objects.filter(product__category=category).delete()
+        Gallery.objects.bulk_create([Gallery(product=product, image=f'products/{originals[i % len(originals)]}')
+                                     for i, product in enumerate(category.products.all())])
+        started = time.perf_counter()
+        refresh_product_photos(category.products.values_list('pk', flat=True))  # здесь же делаются копии
+        elapsed = time.perf_counter() - started
+        products = list(category.products.all())
+        request = RequestFactory().get('/')
+        request.user = AnonymousUser()
+        cache.clear()
+        html = render_cards(products, request)
+
+        def size_of(url):
+            return os.path.getsize(os.path.join(media, url[len(settings.MEDIA_URL):]))
+
+        before = sum(size_of(product.photo_url) for product in products)
+        after = {1: 0, 2: 0}
+        for srcset in re.findall(r'srcset="([^"]+)"', html):
+            candidates = sorted((int(width[:-1]), url) for url, width in (item.split() for item in srcset.split(', ')))
+            for density in after:  # браузер берёт первую копию не уже 300 css-пикселей * плотность экрана
+                url = next((url for width, url in candidates if width >= 300 * density), candidates[-1][1])
+                after[density] += size_of(url)
+
+    command.stdout.write(f'{size} карточек (копии сделаны за {elapsed:.2f} с): PNG {before / 1024:.0f} КБ, '
+                         f'WebP 1x {after[1] / 1024:.0f} КБ, WebP 2x {after[2] / 1024:.0f} КБ')
+
+
+def bench_checkout(command, size):
+    category = create_products(size)
+    order = Order.objects.create(customer=Customer.objects.create())
+    OrderProduct.objects.bulk_create([OrderProduct(order=order, product=product, quantity=1 + product.pk % 3)
+                                      for product in category.products.all()])
+    timings = []
+    for _ in range(20):
+        with CaptureQueriesContext(connection) as queries:
+            started = time.perf_counter()
+            lines, total = get_cart_snapshot(order)
+            line_items = build_line_items(lines)
+            timings.append(time.perf_counter() - started)
+    command.stdout.write(f'{size} строк корзины -> {len(line_items)} line_items на {total / 100:.2f} USD: '
+                         f'{min(timings) * 1000:.1f} мс, запросов к базе {len(queries)}')
+
+
+def bench_import(command, size):
+    rnd = random.Random(0)
+    with tempfile.TemporaryFile('w+', newline='', encoding='utf-8') as stream:
+        for i in range(size):
+            words = rnd.sample(range(len(WORDS_RU)), 3)
+            stream.write(json.dumps({
+                'slug': f'bench-{i}', 'title_ru': ' '.join(WORDS_RU[w] for w in words) + f' {i}',
+                'title_en': ' '.join(WORDS_EN[w] for w in words) + f' {i}', 'description_ru': WORDS_RU[words[1]],
+                'description_en': WORDS_EN[words[1]], 'price': f'{100 + i % 50}.90', 'quantity': i % 3, 'size': 30,
+                'color': WORDS_RU[words[0]], 'category': f'bench-{i % 10}', 'category_title': f'bench-{i % 10}',
+                'parent_category': 'bench', 'images': [f'products/bench-{i}.png'],
+            }, ensure_ascii=False) + '\n')
+        for title in ['новые товары', 'обновление']:  # время без tracemalloc, он замедляет код в разы
+            stream.seek(0)
+            started = time.perf_counter()
+            import_catalog(stream, 'jsonl')
+            command.stdout.write(f'import_catalog ({title}): {size} строк за {time.perf_counter() - started:.2f} с')
+        stream.seek(0)
+        elapsed, peak = measure_peak(lambda: import_catalog(stream, 'jsonl'))
+        command.stdout.write(f'import_catalog: пик памяти {peak / 2 ** 20:.1f} МБ')
+
+    with open(os.devnull, 'w') as stream:
+        elapsed, peak = measure_peak(lambda: export_catalog(stream, 'jsonl'))
+    command.stdout.write(f'export_catalog: {size} товаров за {elapsed:.2f} с, пик памяти {peak / 2 ** 20:.1f} МБ')
+
+
+def bench_stock(command, size):
+    category = create_products(size)
+    rnd = random.Random(0)
+    slugs = list(category.products.values_list('slug', flat=True))
+    items = [{'slug': slug, 'quantity': rnd.randint(0, 50), 'price': f'{rnd.randint(100, 500)}.{rnd.randint(0, 99):02d}'}
+             for slug in slugs]
+
+    sample = min(size, 1000)  # как list_editable в админке: save() на каждую строку
+    started = time.perf_counter()
+    for product, item in zip(category.products.order_by('pk')[:sample], items):
+        product.quantity, product.price = item['quantity'], item['price']
+        product.save()
+    elapsed = time.perf_counter() - started
+    command.stdout.write(f'save() по строке: {sample} товаров за {elapsed:.2f} с, {sample / elapsed:.0f} строк/с')
+
+    for item in items:  # новые значения у всех строк
+        item['quantity'] += 1
+    with CaptureQueriesContext(connection) as queries:
+        started = time.perf_counter()
+        results = apply_stock_updates(items)
+        elapsed = time.perf_counter() - started
+    updated = sum(result['status'] == 'updated' for result in results)
+    command.stdout.write(f'apply_stock_updates: {size} строк ({updated} изменено) за {elapsed:.2f} с, '
+                         f'{size / elapsed:.0f} строк/с, запросов к базе {len(queries)}')
+
+
+class Command(BaseCommand):
+    help = 'Замеры производительности магазина на временных данных'
+
+    cases = {
+        'cards': (bench_cards, 500),
+        'export': (bench_export, 100000),
+        'search': (bench_search, 100000),
+        'autocomplete': (bench_autocomplete, 100000),
+        'images': (bench_images, 12),
+        'checkout': (bench_checkout, 200),
+        'import': (bench_import, 100000),
+        'stock': (bench_stock, 10000),
+    }
+
+    def add_arguments(self, parser):
+        parser.add_argument('case', choices=sorted(self.cases))
+        parser.add_argument('--size', type=int, help='Размер временных данных')
+
+    def handle(self, *args, **options):
+        bench, default_size = self.cases[options['case']]
+        with transaction.atomic():
+            bench(self, options['size'] or default_size)
+            transaction.set_rollback(True)
@@ -0,0 +1,76 @@
+from django.core.management.base import BaseCommand
+
+from store.catalog import bump_category_generation, refresh_product_photos
+from store.models import Category, Gallery, Product
+from store.storage import hashed_storage, get_content_hash, get_hashed_name
+from store.thumbnails import THUMBNAIL_WIDTHS, get_thumbnail_name
+
+
+def hash_name(storage, name):
+    with storage.open(name) as content:
+        return get_hashed_name(name, get_content_hash(content))
+
+
+def dedupe_media(storage=hashed_storage, dry_run=False):
+    # Переименовываем файлы по хешу содержимого: копии сходятся в один файл, ссылки переводим на него
+    referenced = set(Gallery.objects.values_list('image', flat=True)) | set(Category.objects.values_list('image', flat=True))
+    referenced = {name for name in referenced if name and storage.exists(name)}
+    groups = {}  # имя по хешу -> старые имена файлов с таким содержимым
+    for name in sorted(referenced):
+        new_name = hash_name(storage, name)
+        if new_name != name:
+            groups.setdefault(new_name, []).append(name)
+
+    # Копии среди файлов без ссылок (product1.png рядом с product1_6CGxB66.png) лишние:
+    # оставляем по одному файлу на содержимое, которого нет в базе
+    kept = (referenced - set(sum(groups.values(), []))) | set(groups)
+    seen = set(kept)
+    orphans = []
+    for directory in sorted({model._meta.get_field('image').upload_to.rstrip('/') for model in (Gallery, Category)}):
+        if storage.exists(directory):
+            for filename in sorted(storage.listdir(directory)[1]):
+                name = f'{directory}/{filename}'
+                if name in referenced or name in kept:
+                    continue
+                new_name = hash_name(storage, name)
+                if new_name in seen:
+                    orphans.append(name)
+                seen.add(new_name)
+
+    freed = sum(storage.size(name) for name in orphans)
+    for new_name, old_names in groups.items():
+        freed += sum(storage.size(name) for name in old_names)
+        if not storage.exists(new_name):
+            freed -= storage.size(old_names[0])  # одна копия остаётся под новым именем
+            if not dry_run:
+                with storage.open(old_names[0]) as content:
+                    storage.save(new_name, content)
+    if dry_run:
+        return groups, orphans, freed
+
+    for new_name, old_names in groups.items():
+        Gallery.objects.filter(image__in=old_names).update(image=new_name)
+        Category.objects.filter(image__in=old_names).update(image=new_name)
+    for old_name in sum(groups.values(), orphans):
+        storage.delete(old_name)
+        for width in THUMBNAIL_WIDTHS:
+            storage.delete(get_thumbnail_name(old_name, width))
+
+    if groups:
+        # update() обходит сигналы: обновляем фото в товарах и кеш дерева категорий вручную
+        refresh_product_photos(Product.objects.filter(images__image__in=groups).values_list('pk', flat=True).distinct())
+        bump_category_generation()
+    return groups, orphans, freed
+
+
+class Command(BaseCommand):
+    help = 'Схлопывает одинаковые фото товаров и категорий в один файл по хешу содержимого'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Только посчитать, ничего не менять')
+
+    def handle(self, *args, **options):
+        groups, orphans, freed = dedupe_media(dry_run=options['dry_run'])
+        files = sum(len(old_names) for old_names in groups.values())
+        self.stdout.write(f'Файлов переименовано по хешу: {files}, лишних копий: {files - len(groups) + len(orphans)}, '
+                          f'освобождено {freed / 1024:.0f} КБ')
@@ -0,0 +1,71 @@
+import csv
+import json
+
+from django.core.management.base import BaseCommand
+
+from store.models import Category, Gallery, Product
+
+# Каталог одной строкой на товар: категория по slug, фото - имена файлов в media через |
+COLUMNS = ['slug', 'title_ru', 'title_en', 'description_ru', 'description_en', 'price', 'quantity', 'size', 'color',
+           'category', 'category_title', 'parent_category', 'images']
+PRODUCT_FIELDS = ['pk', 'slug', 'title_ru', 'title_en', 'description_ru', 'description_en', 'price', 'quantity',
+                  'size', 'color', 'category_id']
+
+
+def get_format(path, default='csv'):
+    return 'jsonl' if path and path.endswith(('.jsonl', '.json')) else default
+
+
+def iter_catalog(chunk_size=2000):  # товары пачками по pk, фото пачки - одним запросом
+    categories = {category.pk: category for category in Category.objects.select_related('parent')}
+    last_pk = 0
+    while True:
+        products = list(Product.objects.filter(pk__gt=last_pk).order_by('pk').values(*PRODUCT_FIELDS)[:chunk_size])
+        if not products:
+            return
+        last_pk = products[-1]['pk']
+        images = {}
+        for product_id, image in Gallery.objects.filter(product_id__in=[p['pk'] for p in products]) \
+                .order_by('pk').values_list('product_id', 'image'):
+            images.setdefault(product_id, []).append(image)
+        rows = []
+        for product in products:
+            category = categories[product.pop('category_id')]
+            product['price'] = str(product['price'])
+            product.update(category=category.slug, category_title=category.title,
+                           parent_category=category.parent.slug if category.parent else '',
+                           images=images.get(product.pop('pk'), []))
+            rows.append(product)
+        yield rows
+
+
+def export_catalog(stream, format='csv', chunk_size=2000):
+    count = 0
+    if format == 'csv':
+        writer = csv.DictWriter(stream, COLUMNS)
+        writer.writeheader()
+    for rows in iter_catalog(chunk_size):
+        if format == 'csv':
+            writer.writerows({**row, 'images': '|'.join(row['images'])} for row in rows)
+        else:
+            stream.writelines(json.dumps(row, ensure_ascii=False) + '\n' for row in rows)
+        count += len(rows)
+    return count
+
+
+class Command(BaseCommand):
+    help = 'Выгрузка каталога товаров в CSV или JSONL'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', help='Файл для выгрузки (.csv или .jsonl), по умолчанию stdout')
+        parser.add_argument('--format', choices=['csv', 'jsonl'])
+        parser.add_argument('--chunk-size', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        format = options['format'] or get_format(options['output'])
+        if options['output']:
+            with open(options['output'], 'w', newline='', encoding='utf-8') as stream:
+                count = export_catalog(stream, format, options['chunk_size'])
+            self.stderr.write(f'Выгружено товаров: {count}')
+        else:
+            export_catalog(self.stdout, format, options['chunk_size'])
@@ -0,0 +1,31 @@
+import csv
+
+from django.core.management.base import BaseCommand
+
+from store.mailing import iter_subscribers
+
+
+def export_mails(stream, chunk_size=1000):  # пишем CSV пачками, не загружая всех подписчиков в память
+    writer = csv.writer(stream)
+    writer.writerow(['id', 'mail'])
+    count = 0
+    for chunk in iter_subscribers(chunk_size):
+        writer.writerows(chunk)
+        count += len(chunk)
+    return count
+
+
+class Command(BaseCommand):
+    help = 'Выгрузка почтовых адресов подписчиков в CSV'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', help='Файл для выгрузки, по умолчанию stdout')
+        parser.add_argument('--chunk-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        if options['output']:
+            with open(options['output'], 'w', newline='', encoding='utf-8') as stream:
+                count = export_mails(stream, options['chunk_size'])
+            self.stderr.write(f'Выгружено адресов: {count}')
+        else:
+            export_mails(self.stdout, options['chunk_size'])
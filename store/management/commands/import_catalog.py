@@ -0,0 +1,158 @@
+import csv
+import json
+import sys
+from decimal import Decimal
+from itertools import islice
+
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+
+from store.autocomplete import AUTOCOMPLETE_GENERATION_KEY
+from store.catalog import PHOTO_FIELDS, bump_generation, get_related_pool_key, update_rows
+from store.models import Category, Gallery, Product
+from store.search import index_products
+from store.thumbnails import get_photo_urls
+from .export_catalog import get_format
+
+# Загрузка каталога из выгрузки export_catalog. Строки читаются пачками, категории ищутся по slug
+# в словаре в памяти, товары пишутся через bulk_create и update_rows. Сигналы при этом не срабатывают,
+# поэтому поиск, подсказки, фото в товарах и кеши обновляются здесь же, по пачке за раз.
+# С файлами фото импорт не работает: в товар пишутся только ссылки, уменьшенные копии делает
+# manage.py make_thumbnails, а до тех пор карточка показывает исходник
+
+IMPORT_FIELDS = ['title', 'title_ru', 'title_en', 'description', 'description_ru', 'description_en', 'price',
+                 'quantity', 'size', 'color', 'category', 'updated_at']
+
+DEFAULT_DESCRIPTION = Product._meta.get_field('description').default
+
+
+def read_rows(stream, format='csv'):
+    if format == 'csv':
+        for row in csv.DictReader(stream):
+            row['images'] = [name for name in (row.get('images') or '').split('|') if name]
+            yield row
+    else:
+        for line in stream:
+            if line.strip():
+                yield json.loads(line)
+
+
+def iter_chunks(rows, size):
+    rows = iter(rows)
+    while chunk := list(islice(rows, size)):
+        yield chunk
+
+
+class CategoryMap:  # slug -> id всех категорий, недостающие создаются по ходу импорта
+    def __init__(self):
+        self.ids = dict(Category.objects.exclude(slug=None).values_list('slug', 'pk'))
+        self.created = 0
+
+    def get(self, slug, title='', parent=''):
+        if slug not in self.ids:
+            parent_id = self.get(parent) if parent else None
+            self.ids[slug] = Category.objects.create(title=title or slug, slug=slug, parent_id=parent_id).pk
+            self.created += 1
+        return self.ids[slug]
+
+
+def build_product(row, category_id, now):
+    # title и description без языка modeltranslation при записи берёт из title_ru и description_ru
+    return Product(
+        slug=row['slug'],
+        title_ru=row['title_ru'],
+        title_en=row.get('title_en') or None,
+        description_ru=row.get('description_ru') or DEFAULT_DESCRIPTION,
+        description_en=row.get('description_en') or None,
+        price=Decimal(str(row['price'])),
+        quantity=int(row.get('quantity') or 0),
+        size=int(row.get('size') or 30),
+        color=row.get('color') or 'Серебро',
+        category_id=category_id,
+        updated_at=now,
+    )
+
+
+def import_chunk(rows, categories):
+    rows = list({row['slug']: row for row in rows}.values())  # повтор slug в пачке - берём последнюю строку
+    existing = {slug: (pk, category_id) for slug, pk, category_id in
+                Product.objects.filter(slug__in=[row['slug'] for row in rows]).values_list('slug', 'pk', 'category_id')}
+    attached = set(Gallery.objects.filter(product_id__in=[pk for pk, category_id in existing.values()])
+                   .values_list('product_id', 'image'))
+    with_photo = {product_id for product_id, image in attached}
+    now = timezone.now()
+    products, photos, touched = [], [], set()  # touched - категории, чьи пулы "You may also like" устарели
+    for row in rows:
+        category_id = categories.get(row['category'], row.get('category_title'), row.get('parent_category'))
+        product = build_product(row, category_id, now)
+        product.pk, old_category_id = existing.get(row['slug'], (None, None))
+        if old_category_id != category_id:  # новый товар или перенесённый в другую категорию
+            touched.update(category for category in (old_category_id, category_id) if category)
+        images = row.get('images') or []
+        if images and product.pk not in with_photo:
+            # первое фото товара - первое из строки, отдельный проход по Gallery не нужен
+            for name, value in get_photo_urls(images[0]).items():
+                setattr(product, name, value)
+            if product.pk is not None:
+                photos.append(product)
+        products.append(product)
+    new = [product for product in products if product.pk is None]
+    old = [product for product in products if product.pk is not None]
+
+    Product.objects.bulk_create(new)
+    update_rows(old, IMPORT_FIELDS)
+    update_rows(photos, PHOTO_FIELDS)
+    if any(product.pk is None for product in new):  # база не вернула id из INSERT
+        ids = dict(Product.objects.filter(slug__in=[product.slug for product in new]).values_list('slug', 'pk'))
+        for product in new:
+            product.pk = ids[product.slug]
+
+    # фото: добавляем только имена, которых у товара ещё нет
+    ids = {product.slug: product.pk for product in products}
+    Gallery.objects.bulk_create([Gallery(product_id=ids[row['slug']], image=name)
+                                 for row in rows for name in row.get('images') or []
+                                 if (ids[row['slug']], name) not in attached])
+
+    index_products(products)
+    return len(new), len(old), touched
+
+
+def import_catalog(stream, format='csv', batch_size=2000):
+    categories = CategoryMap()
+    created = updated = 0
+    touched = set()
+    for rows in iter_chunks(read_rows(stream, format), batch_size):
+        with transaction.atomic():
+            new, old, category_ids = import_chunk(rows, categories)
+        created += new
+        updated += old
+        touched |= category_ids
+    # пачки прошли мимо сигналов Product: сбрасываем подсказки и пулы "You may also like" сами
+    bump_generation(AUTOCOMPLETE_GENERATION_KEY)
+    cache.delete_many([get_related_pool_key(category_id) for category_id in touched])
+    return created, updated, categories.created
+
+
+class Command(BaseCommand):
+    help = 'Загрузка каталога товаров из CSV или JSONL (выгрузка export_catalog)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Файл .csv или .jsonl, "-" - читать из stdin')
+        parser.add_argument('--format', choices=['csv', 'jsonl'])
+        parser.add_argument('--batch-size', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        path = options['path']
+        format = options['format'] or get_format(path)
+        try:
+            if path == '-':
+                result = import_catalog(sys.stdin, format, options['batch_size'])
+            else:
+                with open(path, newline='', encoding='utf-8') as stream:
+                    result = import_catalog(stream, format, options['batch_size'])
+        except (OSError, KeyError, ValueError, ArithmeticError) as error:
+            raise CommandError(f'Не удалось загрузить каталог: {error!r}')
+        created, updated, categories = result
+        self.stdout.write(f'Товаров создано: {created}, обновлено: {updated}, новых категорий: {categories}')
@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand
+
+from store.catalog import refresh_product_photos
+from store.models import Product
+
+
+def make_missing_thumbnails(batch_size=500):
+    # Товары, у которых в карточке исходник вместо WebP: после import_catalog или если копии не удались.
+    # refresh_product_photos делает недостающие копии первого фото и переводит карточку на них
+    last_pk = done = 0
+    while True:
+        ids = list(Product.objects.filter(pk__gt=last_pk, photo_srcset='').exclude(photo_url='')
+                   .order_by('pk').values_list('pk', flat=True)[:batch_size])
+        if not ids:
+            return done
+        last_pk = ids[-1]
+        refresh_product_photos(ids)
+        done += len(ids)
+
+
+class Command(BaseCommand):
+    help = 'Делает уменьшенные копии фото для товаров, у которых их ещё нет'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        done = make_missing_thumbnails(options['batch_size'])
+        self.stdout.write(f'Проверено товаров без уменьшенных копий: {done}')
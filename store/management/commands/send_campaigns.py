@@ -0,0 +1,27 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from store.mailing import send_queued_campaigns, BATCH_SIZE, BATCH_DELAY, RETRIES
+
+
+class Command(BaseCommand):
+    help = 'Воркер рассылок: отправляет рассылки из очереди'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--loop', action='store_true', help='Не завершаться, проверять очередь постоянно')
+        parser.add_argument('--interval', type=float, default=10, help='Пауза между проверками очереди, сек')
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+        parser.add_argument('--delay', type=float, default=BATCH_DELAY, help='Пауза между пачками писем, сек')
+        parser.add_argument('--retries', type=int, default=RETRIES)
+
+    def handle(self, *args, **options):
+        while True:
+            campaigns = send_queued_campaigns(batch_size=options['batch_size'], delay=options['delay'],
+                                              retries=options['retries'])
+            for campaign in campaigns:
+                self.stdout.write(f'{campaign}: отправлено {campaign.sent} из {campaign.total}, '
+                                  f'ошибок {campaign.failed}')
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
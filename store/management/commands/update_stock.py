@@ -0,0 +1,45 @@
+import csv
+import json
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from store.stock import apply_stock_updates, count_results
+from .export_catalog import get_format
+
+
+def read_updates(stream, format='csv'):  # CSV с колонками slug,quantity,price или JSONL/JSON-список
+    if format == 'csv':
+        return list(csv.DictReader(stream))
+    content = stream.read()
+    if content.lstrip().startswith('['):
+        return json.loads(content)
+    return [json.loads(line) for line in content.splitlines() if line.strip()]
+
+
+class Command(BaseCommand):
+    help = 'Обновляет остатки и цены товаров по выгрузке склада одной транзакцией'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Файл .csv, .jsonl или .json, "-" - читать из stdin')
+        parser.add_argument('--format', choices=['csv', 'jsonl'])
+
+    def handle(self, *args, **options):
+        path = options['path']
+        format = options['format'] or get_format(path)
+        try:
+            if path == '-':
+                updates = read_updates(sys.stdin, format)
+            else:
+                with open(path, newline='', encoding='utf-8') as stream:
+                    updates = read_updates(stream, format)
+        except (OSError, ValueError) as error:
+            raise CommandError(f'Не удалось прочитать файл: {error!r}')
+
+        results = apply_stock_updates(updates)
+        for number, result in enumerate(results, 1):
+            if result['status'] in ('invalid', 'not_found'):
+                self.stderr.write(f'строка {number}: {result["slug"]} - {result.get("error", "товар не найден")}')
+        counts = count_results(results)
+        self.stdout.write(f'Обновлено: {counts.get("updated", 0)}, без изменений: {counts.get("unchanged", 0)}, '
+                          f'не найдено: {counts.get("not_found", 0)}, с ошибками: {counts.get("invalid", 0)}')
@@ -0,0 +1,32 @@
+# Generated by Django 4.1.7 on 2026-10-18 16:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0010_product_category_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MailCampaign',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('subject', models.CharField(default='У нас новая акция', max_length=255, verbose_name='Тема')),
+                ('text', models.TextField(verbose_name='Текст рассылки')),
+                ('status', models.CharField(choices=[('queued', 'В очереди'), ('sending', 'Отправляется'), ('done', 'Отправлена')], default='queued', max_length=20, verbose_name='Статус')),
+                ('total', models.IntegerField(default=0, verbose_name='Всего адресов')),
+                ('sent', models.IntegerField(default=0, verbose_name='Отправлено')),
+                ('failed', models.IntegerField(default=0, verbose_name='Не доставлено')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Дата создания')),
+                ('finished_at', models.DateTimeField(blank=True, null=True, verbose_name='Дата завершения')),
+            ],
+            options={
+                'verbose_name': 'Рассылка',
+                'verbose_name_plural': 'Рассылки',
+                'ordering': ['-created_at'],
+            },
+        ),
+    ]
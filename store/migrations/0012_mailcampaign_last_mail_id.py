@@ -0,0 +1,18 @@
+# Generated by Django 4.1.7 on 2026-10-18 16:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0011_mailcampaign'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='mailcampaign',
+            name='last_mail_id',
+            field=models.BigIntegerField(default=0, verbose_name='Последний обработанный адрес'),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 4.1.7 on 2026-10-18 16:54
+
+from django.db import migrations, models
+
+
+def remove_duplicates(apps, schema_editor):  # старые дубли избранного мешают уникальному индексу
+    FavoriteProducts = apps.get_model('store', 'FavoriteProducts')
+    seen = set()
+    duplicates = []
+    for pk, user_id, product_id in FavoriteProducts.objects.order_by('pk').values_list('pk', 'user_id', 'product_id'):
+        if (user_id, product_id) in seen:
+            duplicates.append(pk)
+        seen.add((user_id, product_id))
+    FavoriteProducts.objects.filter(pk__in=duplicates).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0012_mailcampaign_last_mail_id'),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicates, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='favoriteproducts',
+            constraint=models.UniqueConstraint(fields=('user', 'product'), name='unique_favourite_product'),
+        ),
+    ]
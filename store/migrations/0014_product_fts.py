@@ -0,0 +1,34 @@
+# Generated by Django 4.1.7 on 2026-10-18 17:00
+
+from django.db import migrations
+
+
+def create_fts_index(apps, schema_editor):  # FTS5 есть только в SQLite
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    schema_editor.execute(
+        "CREATE VIRTUAL TABLE store_product_fts USING fts5("
+        "title_ru, title_en, description_ru, description_en, "
+        "tokenize='unicode61 remove_diacritics 2', prefix='2 3 4')"  # индексы префиксов для поиска по мере ввода
+    )
+    schema_editor.execute(
+        "INSERT INTO store_product_fts (rowid, title_ru, title_en, description_ru, description_en) "
+        "SELECT id, COALESCE(title_ru, title), COALESCE(title_en, ''), "
+        "COALESCE(description_ru, description), COALESCE(description_en, '') FROM store_product"
+    )
+
+
+def drop_fts_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        schema_editor.execute('DROP TABLE IF EXISTS store_product_fts')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0013_favoriteproducts_unique'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_fts_index, drop_fts_index),
+    ]
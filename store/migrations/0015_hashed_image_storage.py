@@ -0,0 +1,24 @@
+# Generated by Django 4.1.7 on 2026-10-18 17:08
+
+from django.db import migrations, models
+import store.storage
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0014_product_fts'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='category',
+            name='image',
+            field=models.ImageField(blank=True, null=True, storage=store.storage.HashedMediaStorage(), upload_to='categories/', verbose_name='Изображения'),
+        ),
+        migrations.AlterField(
+            model_name='gallery',
+            name='image',
+            field=models.ImageField(storage=store.storage.HashedMediaStorage(), upload_to='products/', verbose_name='Изображения'),
+        ),
+    ]
@@ -0,0 +1,46 @@
+# Generated by Django 4.1.7 on 2026-10-18 17:11
+
+from django.db import migrations, models
+
+from django.core.files.storage import default_storage
+
+
+def fill_photo_urls(apps, schema_editor):
+    # Первое фото каждого товара переносим в сам товар. Только ссылки на исходник: файлы миграция
+    # не трогает, уменьшенные копии и srcset потом проставит manage.py make_thumbnails
+    Product = apps.get_model('store', 'Product')
+    Gallery = apps.get_model('store', 'Gallery')
+    first_images = {}
+    for product_id, image in Gallery.objects.order_by('product_id', 'pk').values_list('product_id', 'image').iterator():
+        first_images.setdefault(product_id, image)
+    products = []
+    for pk, image in first_images.items():
+        url = default_storage.url(image) if image else ''
+        products.append(Product(pk=pk, photo_url=url, thumbnail_url=url, photo_srcset=''))
+    Product.objects.bulk_update(products, ['photo_url', 'thumbnail_url', 'photo_srcset'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0015_hashed_image_storage'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='photo_srcset',
+            field=models.TextField(blank=True, default='', editable=False),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='photo_url',
+            field=models.CharField(blank=True, default='', editable=False, max_length=255, verbose_name='Фото'),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='thumbnail_url',
+            field=models.CharField(blank=True, default='', editable=False, max_length=255, verbose_name='Миниатюра'),
+        ),
+        migrations.RunPython(fill_photo_urls, migrations.RunPython.noop),
+    ]
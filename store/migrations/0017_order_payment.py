@@ -0,0 +1,23 @@
+# Generated by Django 4.1.7 on 2026-10-18 17:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0016_product_photo_urls'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='paid_at',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='Дата оплаты'),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='stripe_session_id',
+            field=models.CharField(blank=True, default='', max_length=255, verbose_name='Сессия Stripe'),
+        ),
+    ]
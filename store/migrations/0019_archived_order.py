@@ -0,0 +1,64 @@
+# Generated by Django 4.1.7 on 2026-10-18 17:18
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def merge_open_orders(apps, schema_editor):  # лишние открытые корзины покупателя сливаем в самую новую
+    Order = apps.get_model('store', 'Order')
+    OrderProduct = apps.get_model('store', 'OrderProduct')
+    kept = {}
+    open_orders = Order.objects.filter(is_completed=False, customer__isnull=False).order_by('-pk')
+    for pk, customer_id in open_orders.values_list('pk', 'customer_id'):
+        if customer_id not in kept:
+            kept[customer_id] = pk
+            continue
+        lines = {line.product_id: line for line in OrderProduct.objects.filter(order_id=kept[customer_id])}
+        for line in OrderProduct.objects.filter(order_id=pk):
+            if line.product_id in lines:
+                lines[line.product_id].quantity += line.quantity or 0
+                lines[line.product_id].save(update_fields=['quantity'])
+                line.delete()
+            else:
+                line.order_id = kept[customer_id]
+                line.save(update_fields=['order'])
+        Order.objects.filter(pk=pk).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0018_product_decimal_price'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedOrder',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('order_id', models.BigIntegerField(unique=True, verbose_name='Номер заказа')),
+                ('created_at', models.DateTimeField(verbose_name='Дата создания')),
+                ('paid_at', models.DateTimeField(blank=True, null=True, verbose_name='Дата оплаты')),
+                ('stripe_session_id', models.CharField(blank=True, default='', max_length=255, verbose_name='Сессия Stripe')),
+                ('total_cents', models.BigIntegerField(verbose_name='Сумма в центах')),
+                ('total_quantity', models.IntegerField(verbose_name='Количество товаров')),
+                ('items', models.JSONField(default=list, verbose_name='Товары')),
+                ('shipping', models.JSONField(blank=True, null=True, verbose_name='Доставка')),
+            ],
+            options={
+                'verbose_name': 'Архивный заказ',
+                'verbose_name_plural': 'Архив заказов',
+                'ordering': ['-paid_at'],
+            },
+        ),
+        migrations.RunPython(merge_open_orders, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='order',
+            constraint=models.UniqueConstraint(condition=models.Q(('is_completed', False)), fields=('customer',), name='unique_active_cart'),
+        ),
+        migrations.AddField(
+            model_name='archivedorder',
+            name='customer',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='archived_orders', to='store.customer', verbose_name='Покупатель'),
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 4.1.7 on 2026-10-18 17:57
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0019_archived_order'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CheckoutSession',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('session_id', models.CharField(max_length=255, unique=True, verbose_name='Сессия Stripe')),
+                ('order_id', models.BigIntegerField(db_index=True, verbose_name='Номер заказа')),
+                ('items', models.JSONField(default=list, verbose_name='Товары')),
+                ('total_cents', models.BigIntegerField(verbose_name='Сумма в центах')),
+                ('status', models.CharField(choices=[('open', 'Ожидает оплаты'), ('fulfilled', 'Заказ закрыт'), ('review', 'Требует проверки')], default='open', max_length=20, verbose_name='Статус')),
+                ('amount_paid_cents', models.BigIntegerField(blank=True, null=True, verbose_name='Оплачено в центах')),
+                ('paid_at', models.DateTimeField(blank=True, null=True, verbose_name='Дата оплаты')),
+                ('note', models.CharField(blank=True, default='', max_length=255, verbose_name='Причина проверки')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Дата создания')),
+                ('customer', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='store.customer', verbose_name='Покупатель')),
+            ],
+            options={
+                'verbose_name': 'Оплата Stripe',
+                'verbose_name_plural': 'Оплаты Stripe',
+                'ordering': ['-created_at'],
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.1.7 on 2026-10-18 17:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0020_checkout_session'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='mailcampaign',
+            name='heartbeat_at',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='Воркер отметился'),
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 4.1.7 on 2026-10-18 19:40
+
+from django.db import migrations
+
+
+def create_fts_index(prefixes):
+    # Индекс пересоздаётся целиком: набор префиксов у таблицы FTS5 после создания не меняется
+    def create(apps, schema_editor):
+        if schema_editor.connection.vendor != 'sqlite':
+            return
+        schema_editor.execute('DROP TABLE IF EXISTS store_product_fts')
+        schema_editor.execute(
+            "CREATE VIRTUAL TABLE store_product_fts USING fts5("
+            "title_ru, title_en, description_ru, description_en, "
+            f"tokenize='unicode61 remove_diacritics 2', prefix='{prefixes}')"
+        )
+        schema_editor.execute(
+            "INSERT INTO store_product_fts (rowid, title_ru, title_en, description_ru, description_en) "
+            "SELECT id, COALESCE(title_ru, title), COALESCE(title_en, ''), "
+            "COALESCE(description_ru, description), COALESCE(description_en, '') FROM store_product"
+        )
+    return create
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0021_mailcampaign_heartbeat_at'),
+    ]
+
+    operations = [
+        # префиксы до 8 букв: "серебр"* и "platinum"* тоже ищутся по индексу, а не слиянием всех слов с префиксом
+        migrations.RunPython(create_fts_index('2 3 4 5 6 7 8'), create_fts_index('2 3 4')),
+    ]
@@ -1,12 +1,20 @@
 from django.db import models
+from django.db.models import F, Sum, ExpressionWrapper
+from django.utils.functional import cached_property
 from django.urls import reverse
 from django.contrib.auth.models import User
+from .thumbnails import get_srcset
+from .storage import hashed_storage
 
 # Create your models here.
 
+PLACEHOLDER_PHOTO = 'https://pbs.twimg.com/media/FGLPSMpUUA8WaKC.jpg'  # у товара ещё нет фото
+
+
 class Category(models.Model):
     title = models.CharField(max_length=150, verbose_name='Наименование категории')
-    image = models.ImageField(upload_to='categories/', null=True, blank=True, verbose_name='Изображения')
+    image = models.ImageField(upload_to='categories/', storage=hashed_storage, null=True, blank=True,
+                              verbose_name='Изображения')  # одинаковые файлы хранятся один раз
     slug = models.SlugField(unique=True, null=True)  # для ссылок в шапке браузера
     parent = models.ForeignKey('self',  # в этом поле говорим что категория может быть или не быть родителем
                                on_delete=models.CASCADE,
@@ -40,8 +48,9 @@ class Category(models.Model):
 
 class Product(models.Model):
     title = models.CharField(max_length=150, verbose_name='Наименование товара')
-    price = models.FloatField(verbose_name='Цена')
+    price = models.DecimalField(max_digits=12, decimal_places=2, verbose_name='Цена')  # точно до копейки
     created_at = models.DateTimeField(auto_now_add=True, verbose_name='Дата создания')
+    updated_at = models.DateTimeField(auto_now=True, verbose_name='Дата изменения')  # версия для кеша карточки
     quantity = models.IntegerField(default=0, verbose_name='Количество на складе')
     description = models.TextField(default='Здесь скоро будит описание', verbose_name='Описание товара')
     category = models.ForeignKey(Category,
@@ -51,19 +60,27 @@ class Product(models.Model):
     slug = models.SlugField(unique=True, null=True)
     size = models.IntegerField(default=30, verbose_name='Размер в мм')
     color = models.CharField(max_length=30, default='Серебро', verbose_name='Цвет/Материал')
+    # Первое фото товара, обновляется сигналами Gallery
+    photo_url = models.CharField(max_length=255, blank=True, default='', editable=False, verbose_name='Фото')
+    thumbnail_url = models.CharField(max_length=255, blank=True, default='', editable=False, verbose_name='Миниатюра')
+    photo_srcset = models.TextField(blank=True, default='', editable=False)
 
 
     def get_absolute_url(self):
         return reverse('product_detail', kwargs={'slug': self.slug})
 
+    @property
+    def price_cents(self):  # цена в копейках/центах целым числом, как её ждёт Stripe
+        return int(self.price * 100)
+
     def get_first_photo(self):  # метод для получениефото продукта первого фото
-        if self.images:
-            try:
-                return self.images.first().image.url
-            except:
-                return 'https://pbs.twimg.com/media/FGLPSMpUUA8WaKC.jpg'
-        else:
-            return 'https://pbs.twimg.com/media/FGLPSMpUUA8WaKC.jpg'
+        return self.photo_url or PLACEHOLDER_PHOTO
+
+    def get_card_photo(self):  # уменьшенное фото для карточки и корзины
+        return self.thumbnail_url or PLACEHOLDER_PHOTO
+
+    def get_first_photo_srcset(self):
+        return self.photo_srcset
 
 
     def __str__(self):
@@ -76,13 +93,21 @@ class Product(models.Model):
     class Meta:
         verbose_name = 'Товар'
         verbose_name_plural = 'Товары'
+        indexes = [  # под выборки CategoryView: фильтр по подкатегории + сортировка
+            models.Index(fields=['category', 'price'], name='product_category_price_idx'),
+            models.Index(fields=['category', 'color'], name='product_category_color_idx'),
+            models.Index(fields=['category', 'size'], name='product_category_size_idx'),
+        ]
 
 # ----------------------------------------------------------------------------------------
 
 class Gallery(models.Model):
-    image = models.ImageField(upload_to='products/', verbose_name='Изображения')
+    image = models.ImageField(upload_to='products/', storage=hashed_storage, verbose_name='Изображения')
     product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='images')
 
+    def get_srcset(self):
+        return get_srcset(self.image.name)
+
     class Meta:
         verbose_name = 'Изображение'
         verbose_name_plural = 'Галерея товаров'
@@ -119,6 +144,9 @@ class FavoriteProducts(models.Model):
     class Meta:
         verbose_name = 'Избранный товар'
         verbose_name_plural = 'Избранные товары'
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'product'], name='unique_favourite_product'),
+        ]
 
 
 
@@ -136,6 +164,40 @@ class Mail(models.Model):
 
 
 
+class MailCampaign(models.Model):  # Рассылка: создаётся во вьюшке, отправляется воркером (manage.py send_campaigns)
+    STATUS_CHOICES = (
+        ('queued', 'В очереди'),
+        ('sending', 'Отправляется'),
+        ('done', 'Отправлена'),
+    )
+
+    subject = models.CharField(max_length=255, default='У нас новая акция', verbose_name='Тема')
+    text = models.TextField(verbose_name='Текст рассылки')
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='queued', verbose_name='Статус')
+    total = models.IntegerField(default=0, verbose_name='Всего адресов')
+    sent = models.IntegerField(default=0, verbose_name='Отправлено')
+    failed = models.IntegerField(default=0, verbose_name='Не доставлено')
+    last_mail_id = models.BigIntegerField(default=0, verbose_name='Последний обработанный адрес')  # для продолжения после сбоя
+    heartbeat_at = models.DateTimeField(null=True, blank=True, verbose_name='Воркер отметился')  # блокировка воркера
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name='Дата создания')
+    finished_at = models.DateTimeField(null=True, blank=True, verbose_name='Дата завершения')
+
+    def __str__(self):
+        return f'{self.subject} ({self.get_status_display()})'
+
+    @property
+    def progress(self):  # процент обработанных адресов
+        if not self.total:
+            return 100 if self.status == 'done' else 0
+        return round((self.sent + self.failed) * 100 / self.total)
+
+    class Meta:
+        verbose_name = 'Рассылка'
+        verbose_name_plural = 'Рассылки'
+        ordering = ['-created_at']
+
+
+
 class Customer(models.Model):
     user = models.OneToOneField(User, on_delete=models.SET_NULL, blank=True, null=True)
     first_name = models.CharField(max_length=255, default='', verbose_name='Имя покупатель')
@@ -155,6 +217,8 @@ class Order(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     is_completed = models.BooleanField(default=False)
     shipping = models.BooleanField(default=True)
+    stripe_session_id = models.CharField(max_length=255, blank=True, default='', verbose_name='Сессия Stripe')
+    paid_at = models.DateTimeField(null=True, blank=True, verbose_name='Дата оплаты')
 
 
     def __str__(self):
@@ -163,18 +227,28 @@ class Order(models.Model):
     class Meta:
         verbose_name = 'Заказ'
         verbose_name_plural = 'Заказы'
+        constraints = [
+            # одна открытая корзина на покупателя; частичный индекс ищет её, не читая историю заказов
+            models.UniqueConstraint(fields=['customer'], condition=models.Q(is_completed=False),
+                                    name='unique_active_cart'),
+        ]
+
+    @cached_property
+    def cart_totals(self):  # оба итога корзины одним агрегирующим запросом, один раз на объект
+        line_price = ExpressionWrapper(F('quantity') * F('product__price'),
+                                       output_field=models.DecimalField(max_digits=14, decimal_places=2))
+        return self.orderproduct_set.aggregate(
+            total_price=Sum(line_price, default=0),
+            total_quantity=Sum('quantity', default=0),
+        )
 
     @property
     def get_cart_total_price(self):
-        order_products = self.orderproduct_set.all()
-        total_price = sum([product.get_total_price for product in order_products])
-        return total_price
+        return self.cart_totals['total_price']
 
     @property
     def get_cart_total_quantity(self):
-        order_products = self.orderproduct_set.all()
-        total_quantity = sum([product.quantity for product in order_products])
-        return total_quantity
+        return self.cart_totals['total_quantity']
 
 
 class OrderProduct(models.Model):
@@ -194,6 +268,58 @@ class OrderProduct(models.Model):
 
 
 
+class ArchivedOrder(models.Model):  # оплаченный заказ, замороженный с ценами на момент покупки
+    order_id = models.BigIntegerField(unique=True, verbose_name='Номер заказа')
+    customer = models.ForeignKey(Customer, on_delete=models.SET_NULL, null=True, blank=True,
+                                 related_name='archived_orders', verbose_name='Покупатель')
+    created_at = models.DateTimeField(verbose_name='Дата создания')
+    paid_at = models.DateTimeField(null=True, blank=True, verbose_name='Дата оплаты')
+    stripe_session_id = models.CharField(max_length=255, blank=True, default='', verbose_name='Сессия Stripe')
+    total_cents = models.BigIntegerField(verbose_name='Сумма в центах')
+    total_quantity = models.IntegerField(verbose_name='Количество товаров')
+    items = models.JSONField(default=list, verbose_name='Товары')  # [{product_id, title, price_cents, quantity}]
+    shipping = models.JSONField(null=True, blank=True, verbose_name='Доставка')
+
+    def __str__(self):
+        return f'Заказ {self.order_id}'
+
+    @property
+    def total(self):
+        return self.total_cents / 100
+
+    class Meta:
+        verbose_name = 'Архивный заказ'
+        verbose_name_plural = 'Архив заказов'
+        ordering = ['-paid_at']
+
+
+class CheckoutSession(models.Model):  # сессия Stripe Checkout со снимком корзины, который в ней оплачивают
+    STATUS_CHOICES = (
+        ('open', 'Ожидает оплаты'),
+        ('fulfilled', 'Заказ закрыт'),
+        ('review', 'Требует проверки'),  # деньги списаны, но закрыть заказ автоматически нельзя
+    )
+
+    session_id = models.CharField(max_length=255, unique=True, verbose_name='Сессия Stripe')
+    order_id = models.BigIntegerField(db_index=True, verbose_name='Номер заказа')  # заказ после оплаты уходит в архив
+    customer = models.ForeignKey(Customer, on_delete=models.SET_NULL, null=True, blank=True, verbose_name='Покупатель')
+    items = models.JSONField(default=list, verbose_name='Товары')  # как в ArchivedOrder.items
+    total_cents = models.BigIntegerField(verbose_name='Сумма в центах')
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='open', verbose_name='Статус')
+    amount_paid_cents = models.BigIntegerField(null=True, blank=True, verbose_name='Оплачено в центах')
+    paid_at = models.DateTimeField(null=True, blank=True, verbose_name='Дата оплаты')
+    note = models.CharField(max_length=255, blank=True, default='', verbose_name='Причина проверки')
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name='Дата создания')
+
+    def __str__(self):
+        return f'{self.session_id} ({self.get_status_display()})'
+
+    class Meta:
+        verbose_name = 'Оплата Stripe'
+        verbose_name_plural = 'Оплаты Stripe'
+        ordering = ['-created_at']
+
+
 class ShippingAddress(models.Model):
     customer = models.ForeignKey(Customer, on_delete=models.SET_NULL, null=True)
     order = models.ForeignKey(Order, on_delete=models.SET_NULL, null=True)
@@ -0,0 +1,124 @@
+import json
+
+from django.core import signing
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Q
+
+
+class CursorSerializer(signing.JSONSerializer):
+    def dumps(self, obj):  # Decimal и даты в курсоре превращаются в строки
+        return json.dumps(obj, separators=(',', ':'), cls=DjangoJSONEncoder).encode('latin-1')
+
+
+class KeysetPage:
+    # Страница без номера и без COUNT(*): знает только соседние курсоры
+    is_keyset = True
+
+    def __init__(self, object_list, next_cursor, previous_cursor, params):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+        self.params = params
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    def has_other_pages(self):
+        return self.has_next() or self.has_previous()
+
+    def _query(self, cursor):
+        params = self.params.copy()
+        params['cursor'] = cursor
+        return params.urlencode()
+
+    @property
+    def next_query(self):
+        return self._query(self.next_cursor)
+
+    @property
+    def previous_query(self):
+        return self._query(self.previous_cursor)
+
+
+class KeysetPaginationMixin:
+    # Пагинация по курсору (значение поля сортировки + pk) вместо OFFSET:
+    # любая страница стоит как первая, потому что запрос всегда WHERE ... LIMIT n+1
+    sort_fields = ('price', 'color', 'size')
+    cursor_salt = 'store.pagination.cursor'
+
+    def get_sort(self):
+        sort = self.request.GET.get('sort') or 'pk'
+        if sort.lstrip('-') not in self.sort_fields:
+            sort = 'pk'
+        return sort.lstrip('-'), sort.startswith('-')
+
+    def encode_cursor(self, direction, field, descending, obj):
+        # сортировка подписана вместе со значением: курсор от ?sort=color не сравнится с ценой
+        return signing.dumps([direction, field, descending, getattr(obj, field), obj.pk],
+                             salt=self.cursor_salt, serializer=CursorSerializer)
+
+    def decode_cursor(self, field, descending):
+        cursor = self.request.GET.get('cursor')
+        if not cursor:
+            return None
+        try:
+            cursor = signing.loads(cursor, salt=self.cursor_salt, serializer=CursorSerializer)
+        except signing.BadSignature:
+            return None  # испорченный курсор - отдаём первую страницу
+        if len(cursor) != 5 or cursor[1:3] != [field, descending]:
+            return None  # курсор от другой сортировки - тоже первая страница
+        return cursor
+
+    def get_keyset_partitions(self, queryset):
+        # Части выборки, каждая из которых упорядочена своим индексом; их сливает UNION ALL
+        return [queryset]
+
+    def paginate_queryset(self, queryset, page_size):
+        field, descending = self.get_sort()
+        cursor = self.decode_cursor(field, descending)
+        backwards = cursor is not None and cursor[0] == 'prev'
+
+        # Назад листаем в обратном порядке, потом разворачиваем страницу
+        reverse = descending != backwards
+        lookup = 'lt' if reverse else 'gt'
+        ordering = [f'-{field}', '-pk'] if reverse else [field, 'pk']
+        partitions = self.get_keyset_partitions(queryset)
+        if cursor is not None:
+            value, pk = cursor[3], cursor[4]
+            if field == 'pk':
+                condition = Q(**{f'pk__{lookup}': pk})
+            else:
+                # field >= value отдельным условием, чтобы SQLite искал по индексу (category, field)
+                condition = Q(**{f'{field}__{lookup}e': value}) & (Q(**{f'{field}__{lookup}': value}) | Q(**{f'pk__{lookup}': pk}))
+            partitions = [part.filter(condition) for part in partitions]
+        if not partitions:
+            queryset = queryset.none()
+        elif len(partitions) == 1:
+            queryset = partitions[0].order_by(*ordering)
+        else:
+            queryset = partitions[0].union(*partitions[1:], all=True).order_by(*ordering)
+
+        object_list = list(queryset[:page_size + 1])
+        has_more = len(object_list) > page_size
+        object_list = object_list[:page_size]
+        if backwards:
+            object_list.reverse()
+
+        has_next = has_more if not backwards else True
+        has_previous = has_more if backwards else cursor is not None
+        next_cursor = self.encode_cursor('next', field, descending, object_list[-1]) if has_next and object_list else None
+        previous_cursor = self.encode_cursor('prev', field, descending, object_list[0]) if has_previous and object_list else None
+
+        params = self.request.GET.copy()
+        params.pop('page', None)
+        page = KeysetPage(object_list, next_cursor, previous_cursor, params)
+        return None, page, object_list, page.has_other_pages()
@@ -0,0 +1,144 @@
+import hashlib
+import logging
+from collections import Counter
+
+import stripe
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .models import CheckoutSession, Order, OrderProduct
+from .archive import archive_order, freeze_items
+
+# Оплата через Stripe Checkout. Сессия строится из одного снимка корзины, а ключ идемпотентности
+# зависит от заказа, его содержимого и адресов возврата: повторный клик "Оплатить" вернёт ту же сессию,
+# а изменённая корзина или оплата из другой языковой версии сайта - новую. Снимок хранится в CheckoutSession, и подписанный вебхук checkout.session.completed
+# закрывает заказ именно по нему: корзина к этому времени могла измениться
+
+logger = logging.getLogger(__name__)
+
+
+MAX_LINE_ITEMS = 100  # больше строк Stripe Checkout в одну сессию не принимает
+
+
+def get_cart_snapshot(order):  # строки заказа с товарами одним запросом, суммы целыми центами
+    lines = [line for line in order.orderproduct_set.select_related('product') if line.product and line.quantity > 0]
+    total = sum(line.product.price_cents * line.quantity for line in lines)
+    return lines, total
+
+
+def build_line_items(lines):
+    line_items = [{
+        'price_data': {
+            'currency': 'usd',
+            'product_data': {'name': line.product.title},
+            'unit_amount': line.product.price_cents
+        },
+        'quantity': line.quantity
+    } for line in lines]
+    if len(line_items) > MAX_LINE_ITEMS:  # хвост большой корзины одной строкой, чтобы сумма сошлась
+        rest = line_items[MAX_LINE_ITEMS - 1:]
+        line_items = line_items[:MAX_LINE_ITEMS - 1] + [{
+            'price_data': {
+                'currency': 'usd',
+                'product_data': {'name': f'Другие товары ({sum(item["quantity"] for item in rest)} шт.)'},
+                'unit_amount': sum(item['price_data']['unit_amount'] * item['quantity'] for item in rest)
+            },
+            'quantity': 1
+        }]
+    return line_items
+
+
+def get_idempotency_key(order, lines, total, success_url, cancel_url):
+    # Stripe отклоняет тот же ключ с другими параметрами, поэтому в ключ входит всё, что уходит в запрос:
+    # адреса возврата отличаются языковым префиксом (/en/payment_success/)
+    content = ';'.join(f'{line.product_id}:{line.quantity}:{line.product.price_cents}' for line in
+                       sorted(lines, key=lambda line: line.product_id))
+    content = f'{total}|{content}|{success_url}|{cancel_url}'
+    return f'order-{order.pk}-' + hashlib.sha256(content.encode()).hexdigest()[:32]
+
+
+def create_checkout_session(order, lines, total, success_url, cancel_url):
+    session = stripe.checkout.Session.create(
+        api_key=settings.STRIPE_SECRET_KEY,
+        idempotency_key=get_idempotency_key(order, lines, total, success_url, cancel_url),
+        line_items=build_line_items(lines),
+        mode='payment',
+        client_reference_id=str(order.pk),
+        metadata={'order_id': order.pk},
+        success_url=success_url,
+        cancel_url=cancel_url,
+    )
+    Order.objects.filter(pk=order.pk).update(stripe_session_id=session['id'])
+    CheckoutSession.objects.get_or_create(session_id=session['id'], defaults={
+        'order_id': order.pk, 'customer_id': order.customer_id, 'items': freeze_items(lines), 'total_cents': total,
+    })
+    return session
+
+
+def get_webhook_event(payload, signature):
+    if not settings.STRIPE_WEBHOOK_SECRET:
+        return None  # без секрета подпись проверить нечем
+    try:
+        return stripe.Webhook.construct_event(payload, signature, settings.STRIPE_WEBHOOK_SECRET)
+    except (ValueError, stripe.error.SignatureVerificationError):
+        return None
+
+
+def flag_for_review(checkout, note):  # деньги списаны, но заказ автоматически не закрыть - разбирает менеджер
+    logger.error('Оплата Stripe %s (заказ %s) требует проверки: %s', checkout.session_id, checkout.order_id, note)
+    CheckoutSession.objects.filter(pk=checkout.pk).update(status='review', note=note)
+
+
+def keep_unpaid_lines(order, lines, items):
+    # Товары, добавленные в корзину после создания сессии, не оплачены: переносим их в новую корзину.
+    # Возвращает оплаченные товары, которых в корзине уже нет - их резерв на складе уже снят
+    paid = Counter({item['product_id']: item['quantity'] for item in items})
+    in_cart = Counter({line.product_id: line.quantity for line in lines})
+    rest = in_cart - paid
+    if rest:
+        cart = Order.objects.create(customer_id=order.customer_id)
+        OrderProduct.objects.bulk_create([OrderProduct(order=cart, product_id=product_id, quantity=quantity)
+                                          for product_id, quantity in rest.items()])
+    return paid - in_cart
+
+
+def fulfil_order(session):
+    # Вызывается из вебхука: отметка об оплате и закрытие заказа в одной транзакции.
+    # Склад списан ещё при добавлении в корзину, закрытый заказ больше не возвращает товары на склад.
+    # Оплата, которую не сопоставить с заказом, не теряется: она остаётся в CheckoutSession со статусом review
+    if session.get('payment_status') != 'paid':
+        return False
+    now = timezone.now()
+    with transaction.atomic():
+        checkout = CheckoutSession.objects.filter(session_id=session['id']).first()
+        unknown = checkout is None
+        if unknown:  # сессия создана не магазином или до того, как появились снимки
+            reference = str(session.get('client_reference_id') or '')
+            checkout = CheckoutSession.objects.create(session_id=session['id'], total_cents=0,
+                                                      order_id=int(reference) if reference.isdigit() else 0)
+        # условный UPDATE: из двух одновременных доставок события оплату отметит только одна
+        if not CheckoutSession.objects.filter(pk=checkout.pk, paid_at=None).update(
+                paid_at=now, amount_paid_cents=session.get('amount_total')):
+            return False  # Stripe повторил событие
+        if unknown:
+            flag_for_review(checkout, 'оплачена сессия без снимка корзины')
+            return False
+        if session.get('amount_total') != checkout.total_cents:
+            flag_for_review(checkout, f'оплачено {session.get("amount_total")} центов, '
+                                      f'в снимке {checkout.total_cents}')
+            return False
+        if not Order.objects.filter(pk=checkout.order_id, is_completed=False).update(
+                is_completed=True, paid_at=now, stripe_session_id=checkout.session_id):
+            flag_for_review(checkout, 'заказ уже закрыт другой оплатой')  # например, оплатили вторую вкладку
+            return False
+
+        order = Order.objects.get(pk=checkout.order_id)
+        lines, total = get_cart_snapshot(order)
+        missing = keep_unpaid_lines(order, lines, checkout.items)
+        archive_order(order, checkout.items)  # в архив - то, за что заплатили, с ценами из снимка
+        CheckoutSession.objects.filter(pk=checkout.pk).update(status='fulfilled')
+        if missing:
+            flag_for_review(checkout, 'часть оплаченных товаров убрали из корзины до оплаты: '
+                            + ', '.join(f'{product_id} x{quantity}' for product_id, quantity in missing.items()))
+        return True
@@ -0,0 +1,147 @@
+import re
+
+from django.db import connection
+from django.db.models import Q
+from django.utils.translation import get_language
+from .models import Product
+
+# Полнотекстовый поиск товаров по FTS5-индексу SQLite (store_product_fts, rowid = id товара).
+# Индекс обновляют сигналы Product; массовые операции вызывают index_products/rebuild_index сами
+
+FTS_TABLE = 'store_product_fts'
+FTS_COLUMNS = ('title_ru', 'title_en', 'description_ru', 'description_en')
+TITLE_COLUMNS = ('title_ru', 'title_en')
+
+# Глубина выдачи: ранжируются и листаются только SEARCH_DEPTH самых новых совпадений (42 страницы по 12).
+# bm25 считается для каждой ранжируемой строки, и по всей выборке широкий префикс ("зол" - каждый пятый
+# товар) на 100k товаров шёл бы десятки мс. Если совпадений в названиях хватает на всю глубину,
+# ранжируются только они: совпадение в одном описании всё равно оказалось бы ниже
+SEARCH_DEPTH = 500
+
+
+def fts_enabled():
+    return connection.vendor == 'sqlite'
+
+
+def product_row(product):
+    return (
+        product.pk,
+        product.title_ru or product.title,
+        product.title_en or '',
+        product.description_ru or product.description,
+        product.description_en or '',
+    )
+
+
+def index_products(products):
+    if not fts_enabled():
+        return
+    rows = [product_row(product) for product in products]
+    with connection.cursor() as cursor:
+        cursor.executemany(
+            f"INSERT OR REPLACE INTO {FTS_TABLE} (rowid, {', '.join(FTS_COLUMNS)}) VALUES (%s, %s, %s, %s, %s)", rows
+        )
+
+
+def remove_products(ids):
+    if not fts_enabled():
+        return
+    with connection.cursor() as cursor:
+        cursor.executemany(f'DELETE FROM {FTS_TABLE} WHERE rowid = %s', [(pk,) for pk in ids])
+
+
+def rebuild_index():  # полная переиндексация одним INSERT ... SELECT
+    if not fts_enabled():
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {FTS_TABLE}')
+        cursor.execute(
+            f"INSERT INTO {FTS_TABLE} (rowid, {', '.join(FTS_COLUMNS)}) "
+            f"SELECT id, COALESCE(title_ru, title), COALESCE(title_en, ''), "
+            f"COALESCE(description_ru, description), COALESCE(description_en, '') FROM store_product"
+        )
+
+
+def build_match(query):
+    # Каждое слово - префиксный запрос: "зол"* найдёт "золото" и "золотые"
+    words = re.findall(r'\w+', query.lower())
+    return ' '.join(f'"{word}"*' for word in words)
+
+
+def get_weights():  # bm25: название на текущем языке важнее всего
+    if (get_language() or 'ru').startswith('en'):
+        return 4.0, 10.0, 0.5, 1.0
+    return 10.0, 4.0, 1.0, 0.5
+
+
+class SearchResults:
+    # Ленивая выборка для Paginator: count() и срез выполняются прямо по FTS-индексу
+    def __init__(self, query):
+        self.query = query
+        self.match = build_match(query)
+        self._bounds = None
+
+    def fallback_queryset(self):  # для других СУБД: обычный поиск по подстроке
+        condition = Q()
+        for field in FTS_COLUMNS:
+            condition |= Q(**{f'{field}__icontains': self.query})
+        return Product.objects.filter(condition).order_by('pk')
+
+    def count(self):
+        if not self.match:
+            return 0
+        if not fts_enabled():
+            return self.fallback_queryset().count()
+        match, lowest = self.get_bounds()
+        if lowest:
+            return SEARCH_DEPTH  # совпадений не меньше глубины, а глубже выдача не листается
+        with connection.cursor() as cursor:
+            cursor.execute(f'SELECT COUNT(*) FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s', [self.match])
+            return cursor.fetchone()[0]
+
+    def __len__(self):
+        return self.count()
+
+    def get_bounds(self):
+        # Ранжируемый набор: запрос MATCH и наименьший rowid, один раз на выдачу.
+        # Самые новые совпадения FTS5 отдаёт обходом по rowid в обратном порядке, без подсчёта bm25
+        if self._bounds is None:
+            title_match = '{%s} : (%s)' % (' '.join(TITLE_COLUMNS), self.match)
+            with connection.cursor() as cursor:
+                for match in (title_match, self.match):
+                    cursor.execute(f'SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s '
+                                   f'ORDER BY rowid DESC LIMIT 1 OFFSET %s', [match, SEARCH_DEPTH - 1])
+                    row = cursor.fetchone()
+                    if row:
+                        self._bounds = match, row[0]
+                        break
+                else:
+                    self._bounds = self.match, 0  # совпадений меньше глубины - ранжируются все
+        return self._bounds
+
+    def ids(self, limit, offset=0):
+        # ORDER BY rank с весами через rank MATCH FTS5 считает сам, а rowid при равном ранге
+        # даёт одинаковый порядок на всех страницах
+        limit = min(limit, SEARCH_DEPTH - offset)
+        if limit <= 0:
+            return []
+        match, lowest = self.get_bounds()
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s AND rank MATCH %s AND rowid >= %s '
+                f'ORDER BY rank, rowid LIMIT %s OFFSET %s',
+                [match, 'bm25(%s, %s, %s, %s)' % get_weights(), lowest, limit, offset]
+            )
+            return [row[0] for row in cursor.fetchall()]
+
+    def __getitem__(self, item):
+        if not isinstance(item, slice):
+            return self[item:item + 1][0]
+        if not self.match:
+            return []
+        offset, stop = item.start or 0, item.stop
+        if not fts_enabled():
+            return list(self.fallback_queryset()[offset:stop])
+        ids = self.ids(stop - offset, offset)
+        products = Product.objects.in_bulk(ids)
+        return [products[pk] for pk in ids if pk in products]
@@ -0,0 +1,84 @@
+from django.contrib.auth.signals import user_logged_in
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models.signals import pre_save, post_save, post_delete
+from django.dispatch import receiver
+from .models import Category, Product, Gallery
+from .catalog import bump_category_generation, get_related_pool_key, refresh_product_photos
+from .utils import merge_session_cart
+from .search import index_products, remove_products
+from . import autocomplete
+from .thumbnails import make_thumbnails
+from .storage import hashed_storage
+
+
+@receiver([post_save, post_delete], sender=Category)
+def invalidate_category_tree(sender, **kwargs):  # любое изменение категорий сбрасывает кеш дерева
+    bump_category_generation()
+
+
+@receiver(post_save, sender=Gallery)
+def create_thumbnails(sender, instance, **kwargs):  # уменьшенные копии делаем сразу при загрузке
+    try:
+        make_thumbnails(instance.image.name)
+    except (OSError, ValueError):
+        pass  # копии попробуем сделать ещё раз при первом показе
+
+
+@receiver([post_save, post_delete], sender=Gallery)
+def update_product_photo(sender, instance, **kwargs):  # первое фото лежит в товаре и меняет версию карточки
+    refresh_product_photos([instance.product_id])
+
+
+@receiver(pre_save, sender=Product)
+def remember_old_category(sender, instance, **kwargs):  # товар, перенесённый в другую категорию, меняет два пула
+    if instance.pk:
+        instance._old_category_id = sender.objects.filter(pk=instance.pk).values_list('category_id', flat=True).first()
+
+
+@receiver([post_save, post_delete], sender=Product)
+def invalidate_related_pool(sender, instance, **kwargs):  # новый или удалённый товар меняет пул категории
+    old_category_id = getattr(instance, '_old_category_id', None)
+    if kwargs.get('created', True) or old_category_id != instance.category_id:
+        cache.delete_many([get_related_pool_key(category_id) for category_id in {instance.category_id, old_category_id}
+                           if category_id])
+
+
+@receiver(user_logged_in)
+def merge_cart_on_login(sender, request, user, **kwargs):  # корзина гостя переходит в заказ
+    merge_session_cart(request)
+
+
+@receiver(post_save, sender=Product)
+def update_search_index(sender, instance, **kwargs):
+    index_products([instance])
+    autocomplete.product_changed(instance)
+
+
+@receiver(post_delete, sender=Product)
+def remove_from_search_index(sender, instance, **kwargs):
+    remove_products([instance.pk])
+    autocomplete.product_deleted(instance.pk)
+
+
+@receiver(pre_save, sender=Gallery)
+@receiver(pre_save, sender=Category)
+def remember_old_image(sender, instance, **kwargs):  # чтобы освободить файл, если фото заменили
+    if instance.pk:
+        instance._old_image = sender.objects.filter(pk=instance.pk).values_list('image', flat=True).first()
+
+
+@receiver(post_save, sender=Gallery)
+@receiver(post_save, sender=Category)
+def release_replaced_image(sender, instance, **kwargs):
+    old_image = getattr(instance, '_old_image', None)
+    if old_image and old_image != instance.image.name:
+        transaction.on_commit(lambda: hashed_storage.release(old_image))
+
+
+@receiver(post_delete, sender=Gallery)
+@receiver(post_delete, sender=Category)
+def release_deleted_image(sender, instance, **kwargs):  # файл удаляется, когда на него больше никто не ссылается
+    if instance.image:
+        name = instance.image.name
+        transaction.on_commit(lambda: hashed_storage.release(name))
@@ -48,3 +48,26 @@ $('.stop').on('click',function(){
 })
 
 
+
+// Подсказки поиска по мере ввода
+var suggestions = {};
+var searchTimer;
+$('input[data-autocomplete-url]').on('input', function(){
+    var input = $(this);
+    var value = input.val();
+    if (suggestions[value]) {  // выбрали подсказку - переходим сразу на товар
+        window.location = suggestions[value];
+        return;
+    }
+    clearTimeout(searchTimer);
+    searchTimer = setTimeout(function(){
+        $.getJSON(input.data('autocomplete-url'), {q: value}, function(data){
+            var list = $('#' + input.attr('list')).empty();
+            suggestions = {};
+            $.each(data.results, function(i, item){
+                suggestions[item.title] = item.url;
+                list.append($('<option>').attr('value', item.title));
+            });
+        });
+    }, 150);
+})
@@ -0,0 +1,107 @@
+import hmac
+from collections import Counter
+from decimal import Decimal, InvalidOperation
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .catalog import update_rows
+from .models import Product
+
+# Синхронизация остатков и цен со складом: пачка {slug, quantity, price} применяется одной транзакцией.
+# quantity - абсолютный остаток. Пишутся только присланные поля и только там, где значение поменялось:
+# строка с одной ценой не затрёт остаток, который в это время списала корзина, а updated_at -
+# версия кеша карточки - сдвигается только у изменённых товаров
+
+MAX_STOCK_UPDATES = 10000  # строк в одном запросе к API
+STOCK_FIELDS = ('quantity', 'price')
+MAX_PRICE = Decimal(10) ** 10  # DecimalField(max_digits=12, decimal_places=2)
+MAX_QUANTITY = 2 ** 31 - 1  # IntegerField
+
+
+def check_token(header):  # Authorization: Bearer <WAREHOUSE_API_TOKEN>
+    token = settings.WAREHOUSE_API_TOKEN
+    if not token or not header.startswith('Bearer '):
+        return False  # без токена в настройках API закрыт
+    return hmac.compare_digest(header[len('Bearer '):].encode(), token.encode())
+
+
+def parse_quantity(value):
+    try:
+        quantity = int(str(value))
+    except ValueError:
+        raise ValueError('quantity должно быть целым числом')
+    if not 0 <= quantity <= MAX_QUANTITY:
+        raise ValueError('quantity вне допустимого диапазона')
+    return quantity
+
+
+def parse_price(value):
+    try:
+        price = Decimal(str(value))
+    except InvalidOperation:
+        raise ValueError('price должно быть числом')
+    if not price.is_finite() or price < 0 or price >= MAX_PRICE:
+        raise ValueError('price вне допустимого диапазона')
+    if price != price.quantize(Decimal('0.01')):
+        raise ValueError('price - не больше двух знаков после запятой')
+    return price.quantize(Decimal('0.01'))
+
+
+def parse_update(item):
+    if not isinstance(item, dict) or not item.get('slug') or not isinstance(item['slug'], str):
+        raise ValueError('нужен slug товара')
+    values = {}
+    if item.get('quantity') not in (None, ''):
+        values['quantity'] = parse_quantity(item['quantity'])
+    if item.get('price') not in (None, ''):
+        values['price'] = parse_price(item['price'])
+    if not values:
+        raise ValueError('нужно quantity или price')
+    return item['slug'], values
+
+
+def apply_stock_updates(items, batch_size=2000):
+    # Результат по каждой строке в том же порядке: updated, unchanged, not_found или invalid с причиной
+    results, updates, seen = [], [], set()
+    for item in items:
+        try:
+            slug, values = parse_update(item)
+            if slug in seen:
+                raise ValueError('slug повторяется в пачке')
+        except ValueError as error:
+            slug = item.get('slug') if isinstance(item, dict) else None
+            results.append({'slug': slug, 'status': 'invalid', 'error': str(error)})
+            continue
+        seen.add(slug)
+        results.append({'slug': slug})
+        updates.append((results[-1], slug, values))
+
+    now = timezone.now()
+    with transaction.atomic():
+        for start in range(0, len(updates), batch_size):
+            batch = updates[start:start + batch_size]
+            current = {slug: (pk, {'quantity': quantity, 'price': price}) for pk, slug, quantity, price in
+                       Product.objects.filter(slug__in=[slug for result, slug, values in batch])
+                       .values_list('pk', 'slug', 'quantity', 'price')}
+            changed = {}  # набор полей -> товары, каждый набор пишется одним executemany
+            for result, slug, values in batch:
+                if slug not in current:
+                    result['status'] = 'not_found'
+                    continue
+                pk, old = current[slug]
+                values = {field: value for field, value in values.items() if value != old[field]}
+                if not values:
+                    result['status'] = 'unchanged'
+                    continue
+                result['status'] = 'updated'
+                fields = tuple(field for field in STOCK_FIELDS if field in values)
+                changed.setdefault(fields, []).append(Product(pk=pk, updated_at=now, **values))
+            for fields, products in changed.items():
+                update_rows(products, [*fields, 'updated_at'])
+    return results
+
+
+def count_results(results):
+    return dict(Counter(result['status'] for result in results))
@@ -0,0 +1,54 @@
+import hashlib
+import os
+
+from django.apps import apps
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage
+
+from .thumbnails import THUMBNAIL_WIDTHS, get_thumbnail_name
+
+# Фото товаров и категорий хранятся по хешу содержимого: одинаковый файл, загруженный
+# несколько раз, лежит на диске один раз, а Gallery и Category.image ссылаются на одно имя.
+# Файл удаляется, только когда на него не осталось ни одной ссылки
+
+IMAGE_FIELDS = [('store.Gallery', 'image'), ('store.Category', 'image')]
+
+
+def get_content_hash(content):
+    digest = hashlib.sha256()
+    for chunk in content.chunks():
+        digest.update(chunk)
+    content.seek(0)
+    return digest.hexdigest()
+
+
+def get_hashed_name(name, content_hash):
+    directory, filename = os.path.split(name)
+    extension = os.path.splitext(filename)[1].lower()
+    return os.path.join(directory, f'{content_hash}{extension}').replace('\\', '/')
+
+
+class HashedMediaStorage(FileSystemStorage):
+    def save(self, name, content, max_length=None):
+        if name is None:
+            name = content.name
+        if not hasattr(content, 'chunks'):
+            content = File(content, name)
+        name = get_hashed_name(self.generate_filename(name), get_content_hash(content))
+        if self.exists(name):
+            return name  # такой файл уже загружали - второй раз не пишем
+        return super().save(name, content, max_length)
+
+    def count_references(self, name):
+        return sum(apps.get_model(model).objects.filter(**{field: name}).count() for model, field in IMAGE_FIELDS)
+
+    def release(self, name):  # вызывается после удаления или замены ссылки на файл
+        if not name or self.count_references(name):
+            return False
+        self.delete(name)
+        for width in THUMBNAIL_WIDTHS:
+            self.delete(get_thumbnail_name(name, width))
+        return True
+
+
+hashed_storage = HashedMediaStorage()
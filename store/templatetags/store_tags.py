@@ -1,20 +1,22 @@
 from django import template
-from store.models import Category, FavoriteProducts
+from store.catalog import get_category_tree
+from store.facets import get_query
 
 register = template.Library()
 
 
 @register.simple_tag()
 def get_categories():  # Функция для получения глав категории
-    return Category.objects.filter(parent=None)  # у которой нет родителя
+    return get_category_tree()['roots']  # у которой нет родителя, берём из кеша
 
 
 @register.simple_tag()
 def get_subcategories(category):  # В данную функция отпрю глав категорию родителя
-    return Category.objects.filter(parent=category)  # получем подкатегории опредю родителя(категории)
+    return get_category_tree()['children'].get(category.pk, [])  # получем подкатегории опредю родителя(категории)
 
-@register.simple_tag()
-def get_sorted():
+@register.simple_tag(takes_context=True)
+def get_sorted(context):  # Панель фильтров: сортировки и фасеты со счётчиками из CategoryView
+    params = context['request'].GET
     sorters =[
         {
             'title': 'По цене',
@@ -38,11 +40,15 @@ def get_sorted():
             ]
         }
     ]
-    return sorters
-
-
-@register.simple_tag()
-def get_favourite_products(user):
-    fav = FavoriteProducts.objects.filter(user=user)
-    products = [i.product for i in fav]
-    return products
+    groups = [{
+        'title': sorter['title'],
+        'param': 'sort',
+        'options': [{
+            'value': value,
+            'title': title,
+            'count': None,  # у сортировки нет счётчика
+            'selected': params.get('sort') == value,
+            'query': get_query(params, 'sort', value, toggle=False),
+        } for value, title in sorter['sorters']]
+    } for sorter in sorters]
+    return groups + context.get('facets', [])
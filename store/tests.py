@@ -1,3 +1,1323 @@
-from django.test import TestCase
+import hashlib
+import hmac
+import io
+import json
+import os
+import shutil
+import smtplib
+import socketserver
+import sys
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from decimal import Decimal
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+from unittest.mock import patch
+from urllib.parse import parse_qs
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core import mail
+from django.core.cache import cache
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.core.mail.backends import locmem
+from django.db import connection, OperationalError
+from django.db.models import Q, Sum
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone, translation
+
+import stripe
+from PIL import Image
+
+from .models import (PLACEHOLDER_PHOTO, Category, Product, Gallery, FavoriteProducts, Customer, Order, OrderProduct,
+                     Mail, MailCampaign, ArchivedOrder, CheckoutSession, ShippingAddress, City)
+from .utils import CartForAuthenticatedUser
+from .mailing import queue_campaign, claim_campaign, send_queued_campaigns, iter_subscribers
+from .search import SEARCH_DEPTH, SearchResults, rebuild_index
+from . import autocomplete
+from .admin import ProductAdmin
+from .thumbnails import THUMBNAIL_WIDTHS, get_thumbnail_name
+from .storage import hashed_storage
+from .payments import MAX_LINE_ITEMS, get_cart_snapshot, build_line_items
+from .catalog import (get_category_tree, get_category_cache_stats, reset_category_cache_stats, get_related_products,
+                      get_related_pool, get_related_pool_key, refresh_product_photos)
 
 # Create your tests here.
+
+
+def create_catalog(categories=2, subcategories=2, products=3, prefix='c'):
+    # Наполняем каталог: главные категории -> подкатегории -> товары с двумя фото
+    for i in range(categories):
+        category = Category.objects.create(title=f'{prefix}{i}', slug=f'{prefix}{i}')
+        for j in range(subcategories):
+            sub = Category.objects.create(title=f'{prefix}{i}-{j}', slug=f'{prefix}{i}-{j}', parent=category)
+            for k in range(products):
+                product = Product.objects.create(title=f'{prefix}{i}-{j}-{k}', slug=f'{prefix}{i}-{j}-{k}',
+                                                 price=10 + k, quantity=5, category=sub)
+                Gallery.objects.create(product=product, image=f'products/{prefix}{i}{j}{k}-1.png')
+                Gallery.objects.create(product=product, image=f'products/{prefix}{i}{j}{k}-2.png')
+
+
+def count_queries(client, url):
+    client.get(url)  # прогреваем кеш категорий
+    with CaptureQueriesContext(connection) as queries:
+        response = client.get(url)
+    assert response.status_code == 200, response.status_code
+    return len(queries)
+
+
+class ProductListTest(TestCase):
+    def test_query_count_does_not_grow_with_catalog(self):
+        create_catalog(categories=1, subcategories=1, products=1, prefix='a')
+        small = count_queries(self.client, reverse('product_list'))
+
+        create_catalog(categories=3, subcategories=4, products=10, prefix='b')
+        large = count_queries(self.client, reverse('product_list'))
+
+        self.assertEqual(small, large)
+
+    def test_first_photo_is_stored_in_product(self):
+        create_catalog(categories=1, subcategories=1, products=2)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('product_list'))
+        self.assertContains(response, '/media/products/c000-1.png')
+        self.assertNotContains(response, '/media/products/c000-2.png')
+        self.assertFalse([q for q in queries if 'store_gallery' in q['sql']])
+
+    def test_photo_follows_gallery_changes(self):
+        create_catalog(categories=1, subcategories=1, products=1)
+        product = Product.objects.get()
+        product.images.order_by('pk').first().delete()
+        product.refresh_from_db()
+        self.assertEqual(product.get_first_photo(), '/media/products/c000-2.png')
+        product.images.all().delete()
+        product.refresh_from_db()
+        self.assertEqual(product.get_first_photo(), PLACEHOLDER_PHOTO)
+
+
+class FavouriteProductsTest(TestCase):
+    def setUp(self):
+        create_catalog(categories=1, subcategories=2, products=10)
+        self.user = User.objects.create_user('buyer', password='secret')
+        self.client.force_login(self.user)
+
+    def test_favourites_do_not_add_queries_per_card(self):
+        FavoriteProducts.objects.create(user=self.user, product=Product.objects.first())
+        one = count_queries(self.client, reverse('product_list'))
+
+        for product in Product.objects.all()[1:]:
+            FavoriteProducts.objects.create(user=self.user, product=product)
+        many = count_queries(self.client, reverse('product_list'))
+
+        self.assertEqual(one, many)
+
+    def test_favourite_heart_is_rendered(self):
+        FavoriteProducts.objects.create(user=self.user, product=Product.objects.get(slug='c0-0-0'))
+        response = self.client.get(reverse('product_list'))
+        self.assertContains(response, 'images/like.png', count=1)
+
+    def test_toggle_query_count(self):
+        url = reverse('add_favourite', args=['c0-0-0'])
+        for expected in ['DELETE', 'INSERT'], ['DELETE']:  # добавление, затем удаление
+            with CaptureQueriesContext(connection) as queries:
+                self.client.get(url)
+            statements = [q['sql'].split()[0] for q in queries if 'store_favoriteproducts' in q['sql']]
+            self.assertEqual(statements, expected)
+        self.assertFalse(FavoriteProducts.objects.exists())
+
+    def test_double_click_does_not_fail(self):
+        FavoriteProducts.objects.create(user=self.user, product=Product.objects.get(slug='c0-0-0'))
+        # второй запрос двойного клика: его DELETE ничего не нашёл, а первый запрос уже вставил строку
+        with patch('django.db.models.query.QuerySet.delete', return_value=(0, {})):
+            response = self.client.get(reverse('add_favourite', args=['c0-0-0']))
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(FavoriteProducts.objects.count(), 1)
+
+    def test_favourites_page(self):
+        FavoriteProducts.objects.create(user=self.user, product=Product.objects.get(slug='c0-0-0'))
+        response = self.client.get(reverse('fav_products'))
+        self.assertEqual(list(response.context['products']), [Product.objects.get(slug='c0-0-0')])
+
+
+class CategoryTreeCacheTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        reset_category_cache_stats()
+        create_catalog(categories=2, subcategories=2, products=0)
+
+    def test_tree_is_served_from_cache(self):
+        get_category_tree()
+        with self.assertNumQueries(0):
+            tree = get_category_tree()
+        self.assertEqual([c.slug for c in tree['roots']], ['c0', 'c1'])
+        self.assertEqual(get_category_cache_stats(), {'hits': 1, 'misses': 1, 'hit_rate': 0.5})
+
+    def test_signals_invalidate_tree(self):
+        get_category_tree()
+        Category.objects.create(title='new', slug='new')
+        self.assertIn('new', [c.slug for c in get_category_tree()['roots']])
+
+        Category.objects.get(slug='c0').delete()
+        self.assertNotIn('c0', [c.slug for c in get_category_tree()['roots']])
+
+    def test_file_based_cache_is_shared(self):
+        with tempfile.TemporaryDirectory() as location:
+            backend = {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache', 'LOCATION': location}
+            with override_settings(CACHES={'default': backend}):
+                get_category_tree()
+                category = Category.objects.get(slug='c1-0')
+                category.title = 'renamed'
+                category.save()
+                children = get_category_tree()['children'][category.parent_id]
+                self.assertIn('renamed', [c.title for c in children])
+                with self.assertNumQueries(0):
+                    get_category_tree()
+
+    def test_header_uses_cached_categories(self):
+        self.client.get(reverse('product_list'))
+        hits = get_category_cache_stats()['hits']
+        self.client.get(reverse('product_list'))
+        self.assertGreater(get_category_cache_stats()['hits'], hits)
+
+
+class ProductCardCacheTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        create_catalog(categories=1, subcategories=1, products=1)
+        self.product = Product.objects.get()
+        self.product.title_en = 'English title'
+        self.product.save()
+
+    def test_card_is_rendered_from_cache(self):
+        self.client.get(reverse('product_list'))
+        Product.objects.update(title_ru='Обновлено в обход save')  # версия не менялась - кеш отдаёт старое
+        response = self.client.get(reverse('product_list'))
+        self.assertNotContains(response, 'Обновлено в обход save')
+
+        with override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}}):
+            response = self.client.get(reverse('product_list'))  # без кеша карточка строится заново
+        self.assertContains(response, 'Обновлено в обход save')
+
+    def test_save_invalidates_card(self):
+        self.client.get(reverse('product_list'))
+        self.product.title = 'Новое название'
+        self.product.save()
+        self.assertContains(self.client.get(reverse('product_list')), 'Новое название')
+
+    def test_card_depends_on_language(self):
+        self.client.get(reverse('product_list'))
+        with translation.override('en'):
+            response = self.client.get('/en/')
+        self.assertContains(response, 'English title')
+
+
+class KeysetPaginationTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        create_catalog(categories=1, subcategories=2, products=4)
+        for i, product in enumerate(Product.objects.all()):
+            product.color = 'Золото' if i % 3 else 'Серебро'
+            product.size = 30 + i % 2
+            product.save()
+        self.url = reverse('category_detail', kwargs={'slug': 'c0'})
+
+    def walk(self, query, direction='next'):
+        slugs = []
+        while True:
+            response = self.client.get(f'{self.url}?{query}')
+            page = response.context['page_obj']
+            slugs.extend(p.slug for p in page)
+            if not getattr(page, f'has_{direction}')():
+                return slugs, query
+            query = getattr(page, f'{direction}_query')
+
+    def test_pages_follow_every_sort_order(self):
+        for sort in ['', 'price', '-price', 'color', '-color', 'size', '-size']:
+            ordering = [sort or 'pk', '-pk' if sort.startswith('-') else 'pk']
+            expected = list(Product.objects.order_by(*ordering).values_list('slug', flat=True))
+            slugs, last_query = self.walk(f'sort={sort}')
+            self.assertEqual(slugs, expected, sort)
+
+            back, _ = self.walk(last_query, direction='previous')
+            self.assertEqual(back, expected[::-1], sort)
+
+    def test_deep_page_costs_the_same_as_first(self):
+        first = count_queries(self.client, f'{self.url}?sort=price')
+        _, last_query = self.walk('sort=price')
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(f'{self.url}?{last_query}')
+        self.assertEqual(len(queries), first)
+        self.assertFalse([q for q in queries if 'COUNT(*)' in q['sql'].upper()])  # счётчики фасетов не в счёт
+
+    def test_bad_cursor_and_sort_fall_back_to_first_page(self):
+        response = self.client.get(self.url, {'cursor': 'garbage', 'sort': 'quantity'})
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.context['page_obj'].has_previous())
+
+        # курсор от сортировки по цвету с другой сортировкой: первая страница, а не 500
+        cursor = self.client.get(self.url, {'sort': 'color'}).context['page_obj'].next_cursor
+        for sort in ['price', 'size', '-color', '']:
+            response = self.client.get(self.url, {'cursor': cursor, 'sort': sort})
+            self.assertEqual(response.status_code, 200, sort)
+            self.assertFalse(response.context['page_obj'].has_previous(), sort)
+
+
+class FacetFilterTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        create_catalog(categories=1, subcategories=2, products=0)
+        colors = ['Золото', 'Серебро', 'Платина']
+        for i in range(12):
+            Product.objects.create(title=f'p{i}', slug=f'p{i}', price=[500, 3000, 10000, 50000][i % 4],
+                                   color=colors[i % 3], size=28 + i, quantity=i % 2,
+                                   category=Category.objects.get(slug=f'c0-{i % 2}'))
+        self.url = reverse('category_detail', kwargs={'slug': 'c0'})
+
+    def get_facets(self, query):
+        response = self.client.get(f'{self.url}?{query}')
+        return {group['param']: {option['value']: option['count'] for option in group['options']}
+                for group in response.context['facets']}
+
+    def test_filters_combine_facets(self):
+        response = self.client.get(self.url, {'color': ['Золото', 'Серебро'], 'price': ['-1000', '20000-'],
+                                              'in_stock': '1', 'sort': 'price'})
+        products = []
+        while True:
+            page = response.context['page_obj']
+            products.extend(p.slug for p in page)
+            if not page.has_next():
+                break
+            response = self.client.get(f'{self.url}?{page.next_query}')
+        expected = Product.objects.filter(color__in=['Золото', 'Серебро'], quantity__gt=0).filter(
+            Q(price__lt=1000) | Q(price__gte=20000)).order_by('price', 'pk')
+        self.assertEqual(products, [p.slug for p in expected])
+
+    def test_counts_ignore_own_facet(self):
+        facets = self.get_facets('color=Золото')
+        self.assertEqual(facets['color'], {'Золото': 4, 'Платина': 4, 'Серебро': 4})  # можно добавить второй цвет
+        self.assertEqual(facets['price'], {'-1000': 1, '1000-5000': 1, '5000-20000': 1, '20000-': 1})
+        self.assertEqual(facets['size'], {'-30': 1, '30-40': 3, '40-': 0})
+        self.assertEqual(facets['in_stock'], {'1': 2})
+
+    def test_one_query_per_facet(self):
+        first = count_queries(self.client, self.url)
+        Product.objects.bulk_create([Product(title=f'n{i}', slug=f'n{i}', price=i * 1000, color=f'Цвет {i}',
+                                             category=Category.objects.get(slug='c0-0')) for i in range(20)])
+        self.assertEqual(count_queries(self.client, f'{self.url}?color=Цвет 1&size=-30&in_stock=1'), first)
+
+
+class CatalogQueryPlanTest(TestCase):
+    # EXPLAIN QUERY PLAN для каждой сортировки и фильтра CategoryView: без полного
+    # сканирования товаров и без временного B-дерева для ORDER BY
+    sorts = ['', 'price', '-price', 'color', '-color', 'size', '-size']
+
+    def setUp(self):
+        cache.clear()
+        create_catalog(categories=1, subcategories=3, products=3)
+        self.url = reverse('category_detail', kwargs={'slug': 'c0'})
+
+    def listing_plans(self, query):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(f'{self.url}?{query}')
+        listing = [q['sql'] for q in queries if 'FROM "store_product"' in q['sql'] and 'LIMIT' in q['sql']]
+        self.assertEqual(len(listing), 1)
+        with connection.cursor() as cursor:
+            cursor.execute(f'EXPLAIN QUERY PLAN {listing[0]}')
+            plan = [row[-1] for row in cursor.fetchall()]
+        return plan, response.context['page_obj']
+
+    def assert_indexed(self, query):
+        plan, page = self.listing_plans(query)
+        for step in plan:
+            self.assertFalse(step.startswith('SCAN store_product') and 'INDEX' not in step, (query, plan))
+            self.assertNotIn('TEMP B-TREE', step, (query, plan))
+        return page
+
+    def test_listing_queries_use_indexes(self):
+        for sort in self.sorts:
+            for query in [f'sort={sort}', f'sort={sort}&type=c0-1']:
+                page = self.assert_indexed(query)
+                self.assertTrue(page.has_next())
+                self.assert_indexed(page.next_query)  # следующая страница - запрос с курсором
+
+
+class RelatedProductsTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        create_catalog(categories=1, subcategories=2, products=8)
+        self.product = Product.objects.get(slug='c0-0-0')
+
+    def test_same_category_and_deterministic(self):
+        related = get_related_products(self.product, count=4, seed=1)
+        self.assertEqual(len(related), 4)
+        self.assertNotIn(self.product, related)
+        self.assertEqual({p.category_id for p in related}, {self.product.category_id})
+        self.assertEqual(related, get_related_products(self.product, count=4, seed=1))
+
+    def test_query_count_is_bounded(self):
+        with self.assertNumQueries(2):
+            get_related_products(self.product, count=4, seed=2)
+        with self.assertNumQueries(1):  # пул уже в кеше
+            get_related_products(self.product, count=4, seed=3)
+
+    def test_new_product_enters_pool(self):
+        get_related_products(self.product)
+        new = Product.objects.create(title='new', slug='new', price=1, category=self.product.category)
+        pools = [get_related_products(self.product, count=7, seed=seed) for seed in range(5)]
+        self.assertTrue(any(new in related for related in pools))
+
+    def test_pool_samples_whole_category(self):
+        seen = set()
+        with patch('store.catalog.RELATED_POOL_SIZE', 3):
+            for _ in range(20):
+                cache.delete(get_related_pool_key(self.product.category_id))  # пул истёк по таймауту
+                seen.update(get_related_pool(self.product.category_id))
+        self.assertEqual(seen, set(self.product.category.products.values_list('pk', flat=True)))
+
+    def test_moved_product_changes_both_pools(self):
+        other = Product.objects.get(slug='c0-1-0')
+        get_related_pool(self.product.category_id), get_related_pool(other.category_id)
+        other.category = self.product.category
+        other.save()
+        self.assertIn(other.pk, get_related_pool(self.product.category_id))
+        self.assertNotIn(other.pk, get_related_pool(Category.objects.get(slug='c0-1').pk))
+
+    def test_detail_page(self):
+        response = self.client.get(self.product.get_absolute_url())
+        self.assertEqual(len(response.context['products']), 4)
+
+
+class CartTotalsTest(TestCase):
+    def setUp(self):
+        create_catalog(categories=1, subcategories=1, products=6)
+        self.user = User.objects.create_user('buyer', password='secret')
+        self.client.force_login(self.user)
+        self.order = Order.objects.create(customer=Customer.objects.create(user=self.user))
+
+    def fill_cart(self, products):
+        for i, product in enumerate(products, start=1):
+            OrderProduct.objects.create(order=self.order, product=product, quantity=i)
+
+    def test_totals_in_one_query(self):
+        self.fill_cart(Product.objects.order_by('pk')[:3])  # цены 10, 11, 12
+        order = Order.objects.get(pk=self.order.pk)
+        with self.assertNumQueries(1):
+            self.assertEqual(order.get_cart_total_price, 10 * 1 + 11 * 2 + 12 * 3)
+            self.assertEqual(order.get_cart_total_quantity, 6)
+
+    def test_empty_cart(self):
+        self.assertEqual(self.order.get_cart_total_price, 0)
+        self.assertEqual(self.order.get_cart_total_quantity, 0)
+
+    def test_cart_page_query_count_does_not_grow(self):
+        self.fill_cart(Product.objects.order_by('pk')[:1])
+        one = count_queries(self.client, reverse('cart'))
+        OrderProduct.objects.all().delete()
+        self.fill_cart(Product.objects.order_by('pk'))
+        many = count_queries(self.client, reverse('cart'))
+        self.assertEqual(one, many)
+
+
+class CartMutationTest(TestCase):
+    def setUp(self):
+        create_catalog(categories=1, subcategories=1, products=1)
+        self.product = Product.objects.get()
+        self.cart = CartForAuthenticatedUser(SimpleNamespace(user=User.objects.create_user('buyer')))
+
+    def test_add_and_remove_move_stock(self):
+        self.cart.add_or_delete(self.product.pk, 'add')
+        self.cart.add_or_delete(self.product.pk, 'add')
+        self.cart.add_or_delete(self.product.pk, 'delete')
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.quantity, 4)
+        self.assertEqual(OrderProduct.objects.get().quantity, 1)
+
+        self.cart.add_or_delete(self.product.pk, 'delete')
+        self.cart.add_or_delete(self.product.pk, 'delete')  # лишнее удаление не возвращает товар на склад
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.quantity, 5)
+        self.assertFalse(OrderProduct.objects.exists())
+
+    def test_add_stops_at_zero_stock(self):
+        for i in range(7):
+            self.cart.add_or_delete(self.product.pk, 'add')
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.quantity, 0)
+        self.assertEqual(OrderProduct.objects.get().quantity, 5)
+
+    def test_add_query_count(self):
+        self.cart.add_or_delete(self.product.pk, 'add')
+        with CaptureQueriesContext(connection) as queries:
+            self.cart.add_or_delete(self.product.pk, 'add')
+        statements = [q['sql'] for q in queries if 'SAVEPOINT' not in q['sql']]
+        self.assertEqual(len(statements), 4)  # покупатель, заказ, склад, строка корзины
+        self.assertTrue(all('SET "quantity"' in sql for sql in statements[2:]))
+
+
+class CartConcurrencyTest(TransactionTestCase):
+    stock = 20
+
+    def test_parallel_clicks_never_oversell(self):
+        create_catalog(categories=1, subcategories=1, products=1)
+        product = Product.objects.get()
+        Product.objects.update(quantity=self.stock)
+        users = [User.objects.create_user(f'buyer{i}') for i in range(8)]
+        errors = []
+
+        def click(user):
+            cart = CartForAuthenticatedUser(SimpleNamespace(user=user))
+            try:
+                for action in ['add'] * 6 + ['delete', 'add', 'delete'] * 2:
+                    while True:
+                        try:
+                            cart.add_or_delete(product.pk, action)
+                            break
+                        except OperationalError:  # база занята другим потоком - транзакция откатилась, повторяем
+                            continue
+            except Exception as error:
+                errors.append(error)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=click, args=(user,)) for user in users]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        product.refresh_from_db()
+        in_carts = OrderProduct.objects.aggregate(total=Sum('quantity'))['total'] or 0
+        self.assertGreaterEqual(product.quantity, 0)
+        self.assertEqual(product.quantity + in_carts, self.stock)
+        self.assertFalse(OrderProduct.objects.filter(quantity__lte=0).exists())
+
+
+class AnonymousCartTest(TestCase):
+    def setUp(self):
+        create_catalog(categories=1, subcategories=1, products=2)
+        self.first, self.second = Product.objects.order_by('pk')
+        User.objects.create_user('buyer', password='secret')
+
+    def click(self, product, action='add'):
+        return self.client.get(reverse('to_cart', args=[product.pk, action]))
+
+    def test_anonymous_cart_does_not_write_to_db(self):
+        with CaptureQueriesContext(connection) as queries:
+            for i in range(3):
+                self.click(self.first)
+            self.click(self.second)
+            self.click(self.first, 'delete')
+            response = self.client.get(reverse('cart'))
+
+        self.assertFalse([q for q in queries if not q['sql'].startswith('SELECT')])
+        self.assertEqual(response.context['order'].get_cart_total_quantity, 3)
+        self.assertEqual(response.context['order'].get_cart_total_price, 10 * 2 + 11)
+        self.assertContains(response, 'c0-0-1')
+
+    def test_anonymous_cart_respects_stock(self):
+        for i in range(7):
+            self.click(self.first)
+        response = self.client.get(reverse('cart'))
+        self.assertEqual(response.context['order'].get_cart_total_quantity, 5)
+
+    def test_cart_is_merged_on_login(self):
+        user = User.objects.get()
+        order = Order.objects.create(customer=Customer.objects.create(user=user))
+        OrderProduct.objects.create(order=order, product=self.first, quantity=1)
+        Product.objects.filter(pk=self.first.pk).update(quantity=4)
+
+        for i in range(2):
+            self.click(self.first)
+            self.click(self.second)
+        self.client.post(reverse('login'), {'username': 'buyer', 'password': 'secret'})
+
+        lines = dict(order.orderproduct_set.values_list('product__slug', 'quantity'))
+        self.assertEqual(lines, {'c0-0-0': 3, 'c0-0-1': 2})
+        self.assertEqual(Product.objects.get(pk=self.first.pk).quantity, 2)
+        self.assertEqual(Product.objects.get(pk=self.second.pk).quantity, 3)
+        self.assertEqual(self.client.get(reverse('cart')).context['order'], order)
+
+        self.assertEqual(self.client.cookies['cart'].value, '')  # cookie удалена в ответе на вход
+        self.client.get(reverse('logout'))
+        self.client.post(reverse('login'), {'username': 'buyer', 'password': 'secret'})
+        lines = dict(order.orderproduct_set.values_list('product__slug', 'quantity'))
+        self.assertEqual(lines, {'c0-0-0': 3, 'c0-0-1': 2})  # повторный вход корзину не добавляет
+
+    def test_cart_is_kept_in_own_signed_cookie(self):
+        self.click(self.first)
+        self.click(self.second)
+        self.assertIn('cart', self.client.cookies)
+        self.assertNotIn(settings.SESSION_COOKIE_NAME, self.client.cookies)  # сессия гостю не нужна
+        self.assertEqual(self.client.get(reverse('cart')).context['order'].get_cart_total_quantity, 2)
+
+        value = self.client.cookies['cart'].value
+        forged = value.replace(f'"{self.first.pk}":1', f'"{self.first.pk}":5')  # меняем количество без подписи
+        self.assertNotEqual(forged, value)
+        self.client.cookies['cart'] = forged
+        self.assertEqual(self.client.get(reverse('cart')).context['order'].get_cart_total_quantity, 0)
+
+    def test_checkout_requires_login(self):
+        self.click(self.first)
+        self.assertRedirects(self.client.get(reverse('checkout')), reverse('login_registration'))
+
+
+class CountingEmailBackend(locmem.EmailBackend):  # считает открытые соединения
+    connections = 0
+    failures = 0  # сколько раз подряд упасть перед успешной отправкой
+    refused = set()  # адреса, которые сервер не принимает
+    disconnect = set()  # на этих адресах соединение один раз обрывается
+
+    def open(self):
+        CountingEmailBackend.connections += 1
+
+    def send_messages(self, messages):
+        if CountingEmailBackend.failures:
+            CountingEmailBackend.failures -= 1
+            raise smtplib.SMTPServerDisconnected('stand-in failure')
+        sent = 0
+        for message in messages:  # как SMTP: письма до ошибки уже доставлены
+            if set(message.to) & CountingEmailBackend.disconnect:
+                CountingEmailBackend.disconnect -= set(message.to)
+                raise smtplib.SMTPServerDisconnected('stand-in failure')
+            if set(message.to) & CountingEmailBackend.refused:
+                raise smtplib.SMTPRecipientsRefused({address: (550, b'no such user') for address in message.to})
+            sent += super().send_messages([message])
+        return sent
+
+
+class SMTPStandIn(socketserver.StreamRequestHandler):  # минимальный SMTP-сервер для тестов
+    def handle(self):
+        self.server.connections += 1
+        self.wfile.write(b'220 stand-in\r\n')
+        while line := self.rfile.readline():
+            command = line.strip().upper()
+            if command == b'DATA':
+                self.wfile.write(b'354 go on\r\n')
+                while self.rfile.readline() not in (b'.\r\n', b''):
+                    pass
+                self.server.messages += 1
+                self.wfile.write(b'250 queued\r\n')
+            elif command == b'QUIT':
+                self.wfile.write(b'221 bye\r\n')
+                return
+            else:
+                self.wfile.write(b'250 ok\r\n')
+
+
+@override_settings(EMAIL_BACKEND='store.tests.CountingEmailBackend')
+class MailCampaignTest(TestCase):
+    def setUp(self):
+        CountingEmailBackend.connections = 0
+        CountingEmailBackend.failures = 0
+        CountingEmailBackend.refused = set()
+        CountingEmailBackend.disconnect = set()
+        Mail.objects.bulk_create([Mail(mail=f'user{i}@example.com') for i in range(25)])
+
+    def test_view_only_queues_campaign(self):
+        admin = User.objects.create_superuser('admin', password='secret')
+        self.client.force_login(admin)
+        response = self.client.post(reverse('send_mail'), {'text': 'Скидки!'})
+        self.assertRedirects(response, reverse('send_mail'))
+        self.assertEqual(len(mail.outbox), 0)
+        campaign = MailCampaign.objects.get()
+        self.assertEqual((campaign.status, campaign.total), ('queued', 25))
+
+    def test_worker_sends_in_batches_over_one_connection_each(self):
+        queue_campaign('Скидки!')
+        campaign, = send_queued_campaigns(batch_size=10, delay=0)
+        self.assertEqual((campaign.status, campaign.sent, campaign.failed, campaign.progress), ('done', 25, 0, 100))
+        self.assertEqual(CountingEmailBackend.connections, 3)
+        self.assertEqual(len(mail.outbox), 25)
+        self.assertEqual(mail.outbox[0].to, ['user0@example.com'])
+
+    def test_failed_batches_are_retried(self):
+        CountingEmailBackend.failures = 2
+        queue_campaign('Скидки!')
+        campaign, = send_queued_campaigns(batch_size=25, delay=0, retries=2)
+        self.assertEqual((campaign.sent, campaign.failed), (25, 0))
+
+        CountingEmailBackend.failures = 5
+        queue_campaign('Ещё скидки!')
+        campaign, = send_queued_campaigns(batch_size=25, delay=0, retries=1)
+        self.assertEqual((campaign.sent, campaign.failed, campaign.status), (0, 25, 'done'))
+
+    def test_refused_address_does_not_resend_batch(self):
+        CountingEmailBackend.refused = {'user4@example.com'}
+        queue_campaign('Скидки!')
+        campaign, = send_queued_campaigns(batch_size=10, delay=0)
+        self.assertEqual((campaign.sent, campaign.failed), (24, 1))
+        addresses = [message.to[0] for message in mail.outbox]
+        self.assertEqual(sorted(addresses), sorted({f'user{i}@example.com' for i in range(25)} - {'user4@example.com'}))
+        self.assertEqual(CountingEmailBackend.connections, 3)
+
+    def test_broken_connection_resends_only_the_rest(self):
+        CountingEmailBackend.disconnect = {'user4@example.com'}  # соединение рвётся на пятом письме пачки
+        queue_campaign('Скидки!')
+        campaign, = send_queued_campaigns(batch_size=10, delay=0)
+        self.assertEqual((campaign.sent, campaign.failed), (25, 0))
+        self.assertEqual(len(mail.outbox), 25)
+        self.assertEqual(len({message.to[0] for message in mail.outbox}), 25)
+        self.assertEqual(CountingEmailBackend.connections, 4)
+
+    def test_interrupted_campaign_resumes(self):
+        campaign = queue_campaign('Скидки!')
+        last = Mail.objects.order_by('pk')[9]
+        MailCampaign.objects.filter(pk=campaign.pk).update(status='sending', sent=10, last_mail_id=last.pk)
+        campaign, = send_queued_campaigns(batch_size=10, delay=0)
+        self.assertEqual((campaign.sent, len(mail.outbox)), (25, 15))
+
+    def test_campaign_is_claimed_by_one_worker(self):
+        campaign = queue_campaign('Скидки!')
+        self.assertTrue(claim_campaign(MailCampaign.objects.get(pk=campaign.pk)))  # первый воркер ещё отправляет
+        self.assertEqual(send_queued_campaigns(batch_size=10, delay=0), [])  # второй её не трогает
+        self.assertEqual(len(mail.outbox), 0)
+
+        MailCampaign.objects.filter(pk=campaign.pk).update(heartbeat_at=timezone.now() - timedelta(hours=1))
+        campaign, = send_queued_campaigns(batch_size=10, delay=0)  # отметка устарела - первый воркер упал
+        self.assertEqual((campaign.status, len(mail.outbox)), ('done', 25))
+
+    def test_subscribers_are_streamed_in_chunks(self):
+        with self.assertNumQueries(4):  # 10 + 10 + 5 и пустой запрос в конце
+            chunks = [len(chunk) for chunk in iter_subscribers(chunk_size=10)]
+        self.assertEqual(chunks, [10, 10, 5])
+
+    def test_export_command(self):
+        out = io.StringIO()
+        call_command('export_mails', chunk_size=7, stdout=out)
+        lines = out.getvalue().splitlines()
+        self.assertEqual(lines[0], 'id,mail')
+        self.assertEqual(len(lines), 26)
+        self.assertTrue(lines[-1].endswith(',user24@example.com'))
+
+    def test_smtp_connection_is_reused_within_batch(self):
+        server = socketserver.ThreadingTCPServer(('127.0.0.1', 0), SMTPStandIn)
+        server.connections = server.messages = 0
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        try:
+            backend = {'EMAIL_BACKEND': 'django.core.mail.backends.smtp.EmailBackend', 'EMAIL_HOST': '127.0.0.1',
+                       'EMAIL_PORT': server.server_address[1], 'EMAIL_USE_TLS': False,
+                       'EMAIL_HOST_USER': '', 'EMAIL_HOST_PASSWORD': ''}
+            with override_settings(**backend):
+                queue_campaign('Скидки!')
+                campaign, = send_queued_campaigns(batch_size=10, delay=0)
+        finally:
+            server.shutdown()
+            server.server_close()
+        self.assertEqual((campaign.sent, server.messages, server.connections), (25, 25, 3))
+
+
+class SaveEmailTest(TestCase):
+    def setUp(self):
+        Mail.objects.bulk_create([Mail(mail=f'user{i}@example.com') for i in range(50)])
+        self.client.force_login(User.objects.create_user('buyer'))
+
+    def test_new_email_is_saved(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.client.post(reverse('save_email'), {'email': 'new@example.com'})
+        self.assertTrue(Mail.objects.filter(mail='new@example.com').exists())
+        self.assertLessEqual(len([q for q in queries if 'store_mail' in q['sql']]), 2)
+
+    def test_existing_email_is_found_by_index(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.client.post(reverse('save_email'), {'email': 'user7@example.com'})
+        mail_queries = [q['sql'] for q in queries if 'store_mail' in q['sql']]
+        self.assertEqual(len(mail_queries), 1)
+        self.assertIn('WHERE "store_mail"."mail" =', mail_queries[0])
+        self.assertEqual(Mail.objects.count(), 50)
+
+
+class SearchTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        create_catalog(categories=1, subcategories=1, products=0)
+        category = Category.objects.get(slug='c0-0')
+        for i, (ru, en) in enumerate([('Золотые часы', 'Gold watch'), ('Серебряная цепь', 'Silver chain'),
+                                      ('Золотое кольцо', 'Gold ring'), ('Браслет', 'Bracelet with gold')]):
+            Product.objects.create(title_ru=ru, title_en=en, slug=f'p{i}', price=10, category=category)
+
+    def search(self, query):
+        return [p.slug for p in SearchResults(query)[:10]]
+
+    def test_prefix_search_in_both_languages(self):
+        self.assertEqual(sorted(self.search('зол')), ['p0', 'p2'])
+        self.assertEqual(sorted(self.search('silv')), ['p1'])
+        self.assertEqual(self.search('gold wat'), ['p0'])
+        self.assertEqual(self.search('   '), [])
+
+    def test_title_ranks_above_description(self):
+        product = Product.objects.get(slug='p1')
+        product.description_ru = 'золото'
+        product.save()
+        self.assertEqual(self.search('золот')[-1], 'p1')  # совпадение только в описании
+
+    def test_index_follows_saves_and_deletes(self):
+        product = Product.objects.get(slug='p3')
+        product.title_ru = 'Платиновый браслет'
+        product.save()
+        self.assertEqual(self.search('платин'), ['p3'])
+        product.delete()
+        self.assertEqual(self.search('платин'), [])
+
+        Product.objects.filter(slug='p1').update(title_ru='Медная цепь')  # в обход сигналов
+        rebuild_index()
+        self.assertEqual(self.search('медн'), ['p1'])
+
+    def test_results_are_ranked_and_paged_to_depth(self):
+        category = Category.objects.get(slug='c0-0')
+        Product.objects.bulk_create([Product(title_ru=f'Товар {i}', title_en=f'Item {i}', description_ru='кольцо',
+                                             slug=f'ring-{i}', price=10, category=category) for i in range(600)])
+        Product.objects.create(title_ru='Кольцо', title_en='Ring', slug='best', price=10, category=category)
+        rebuild_index()
+        results = SearchResults('кольцо')
+        self.assertEqual(results.count(), SEARCH_DEPTH)  # глубже выдача не листается
+        self.assertEqual(results[0].slug, 'best')  # лучшее совпадение добавлено последним
+        pages = [product.slug for start in range(0, results.count() + 50, 50)
+                 for product in results[start:start + 50]]
+        self.assertEqual(len(pages), SEARCH_DEPTH)
+        self.assertEqual(len(set(pages)), len(pages))
+
+    def test_title_matches_fill_the_depth_first(self):
+        category = Category.objects.get(slug='c0-0')
+        Product.objects.bulk_create([Product(title_ru=f'Кольцо {i}', slug=f'title-{i}', price=10, category=category)
+                                     for i in range(30)])
+        Product.objects.bulk_create([Product(title_ru=f'Товар {i}', description_ru='кольцо', slug=f'text-{i}',
+                                             price=10, category=category) for i in range(30)])
+        rebuild_index()
+        with patch('store.search.SEARCH_DEPTH', 20):
+            results = SearchResults('кольц')
+            slugs = [product.slug for product in results[:40]]
+            self.assertEqual(results.count(), 20)
+        self.assertEqual(len(slugs), 20)
+        self.assertTrue(all(slug.startswith('title-') for slug in slugs))  # новые совпадения в описании ниже
+
+    def test_search_page_paginates_cards(self):
+        response = self.client.get(reverse('search'), {'q': 'gold'})
+        self.assertEqual(response.context['paginator'].count, 3)
+        self.assertContains(response, 'product_card-name', count=3)
+
+
+class AutocompleteTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        create_catalog(categories=1, subcategories=1, products=0)
+        category = Category.objects.get(slug='c0-0')
+        for i, (ru, en) in enumerate([('Золотые часы', 'Gold watch'), ('Золотое кольцо', 'Gold ring'),
+                                      ('Ёлочная подвеска', 'Tree pendant')]):
+            Product.objects.create(title_ru=ru, title_en=en, slug=f'p{i}', price=10, category=category)
+
+    def suggest(self, query, language='ru'):
+        with translation.override(language):
+            response = self.client.get(reverse('autocomplete'), {'q': query})
+        return [item['title'] for item in response.json()['results']]
+
+    def test_suggestions_without_queries_after_build(self):
+        self.assertEqual(self.suggest('зол'), ['Золотое кольцо', 'Золотые часы'])
+        with self.assertNumQueries(0):
+            self.assertEqual(self.suggest('  ЕЛОЧ'), ['Ёлочная подвеска'])
+            self.assertEqual(self.suggest('gold r', 'en'), ['Gold ring'])
+            self.assertEqual(self.suggest('tree', 'ru'), ['Ёлочная подвеска'])  # нашли по второму языку
+            self.assertEqual(self.suggest(''), [])
+
+    def test_index_follows_saves_and_deletes(self):
+        self.suggest('зол')
+        product = Product.objects.get(slug='p0')
+        product.title_ru = 'Платиновые часы'
+        product.save()
+        Product.objects.get(slug='p1').delete()
+        with self.assertNumQueries(0):
+            self.assertEqual(self.suggest('зол'), [])
+            self.assertEqual(self.suggest('плат'), ['Платиновые часы'])
+
+    def test_other_process_change_rebuilds_index(self):
+        self.suggest('зол')
+        Product.objects.filter(slug='p0').update(title_ru='Медные часы')  # в обход сигналов
+        autocomplete.bump_generation(autocomplete.AUTOCOMPLETE_GENERATION_KEY)  # так сигнал сообщает из другого процесса
+        self.assertEqual(self.suggest('медн'), ['Медные часы'])
+
+
+    def test_search_while_renaming_in_another_thread(self):
+        index = autocomplete.PrefixIndex()
+        index.build([(pk, f'p{pk}', f'золото {pk}', '') for pk in range(20)])
+        stop, errors = threading.Event(), []
+
+        def rename():  # товары переименовывают, пока другой поток ищет
+            while not stop.is_set():
+                for pk in range(20):
+                    index.update(pk, f'p{pk}', {'ru': f'золото {pk}'})
+
+        thread = threading.Thread(target=rename)
+        switch = sys.getswitchinterval()
+        sys.setswitchinterval(1e-6)
+        thread.start()
+        try:
+            for _ in range(2000):
+                try:
+                    index.search('зол', limit=20)
+                except (KeyError, IndexError) as error:
+                    errors.append(error)
+        finally:
+            stop.set()
+            thread.join()
+            sys.setswitchinterval(switch)
+        self.assertEqual(errors, [])
+
+class ThumbnailTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media)
+        settings = override_settings(MEDIA_ROOT=self.media)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        create_catalog(categories=1, subcategories=1, products=0)
+        self.product = Product.objects.create(title='p', slug='p', price=10, category=Category.objects.get(slug='c0-0'))
+
+    def upload(self, width=800, height=600):
+        buffer = io.BytesIO()
+        Image.new('RGBA', (width, height), (200, 150, 0, 255)).save(buffer, 'PNG')
+        return Gallery.objects.create(product=self.product,
+                                      image=SimpleUploadedFile('photo.png', buffer.getvalue(), 'image/png'))
+
+    def test_upload_creates_every_width(self):
+        image = self.upload()
+        for width in THUMBNAIL_WIDTHS:
+            with default_storage.open(get_thumbnail_name(image.image.name, width)) as thumbnail:
+                self.assertEqual(Image.open(thumbnail).size, (width, width * 3 // 4))
+
+    def test_card_uses_thumbnails(self):
+        image = self.upload()
+        response = self.client.get(reverse('product_detail', kwargs={'slug': 'p'}))
+        self.assertContains(response, f'srcset="{default_storage.url(get_thumbnail_name(image.image.name, 100))} 100w')
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.get_card_photo(), default_storage.url(get_thumbnail_name(image.image.name, 300)))
+
+    def test_missing_thumbnails_are_made_on_refresh(self):
+        image = self.upload()
+        shutil.rmtree(os.path.join(self.media, 'thumbnails'))
+        refresh_product_photos([self.product.pk])  # так же make_thumbnails доделывает старые товары
+        self.product.refresh_from_db()
+        self.assertTrue(self.product.get_first_photo_srcset())
+        self.assertTrue(default_storage.exists(get_thumbnail_name(image.image.name, 600)))
+
+    def test_make_thumbnails_after_import(self):
+        image = self.upload()
+        shutil.rmtree(os.path.join(self.media, 'thumbnails'))
+        Product.objects.filter(pk=self.product.pk).update(photo_url=default_storage.url(image.image.name),
+                                                          thumbnail_url='', photo_srcset='')  # как после import_catalog
+        call_command('make_thumbnails', stdout=io.StringIO())
+        self.product.refresh_from_db()
+        self.assertTrue(self.product.get_first_photo_srcset())
+        self.assertTrue(default_storage.exists(get_thumbnail_name(image.image.name, 300)))
+
+    def test_broken_file_falls_back_to_original(self):
+        image = Gallery.objects.create(product=self.product, image='products/missing.png')
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.get_card_photo(), image.image.url)
+        self.assertEqual(self.product.get_first_photo_srcset(), '')
+
+
+class HashedStorageTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media)
+        settings = override_settings(MEDIA_ROOT=self.media)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        create_catalog(categories=1, subcategories=1, products=2)
+        self.products = list(Product.objects.all())
+        buffer = io.BytesIO()
+        Image.new('RGB', (40, 40), (10, 20, 30)).save(buffer, 'PNG')
+        self.content = buffer.getvalue()
+
+    def upload(self, product, name='photo.png'):
+        return Gallery.objects.create(product=product, image=SimpleUploadedFile(name, self.content, 'image/png'))
+
+    def files(self):
+        return sorted(os.listdir(os.path.join(self.media, 'products')))
+
+    def test_same_content_is_stored_once(self):
+        first = self.upload(self.products[0])
+        second = self.upload(self.products[1], 'copy.PNG')
+        self.assertEqual(first.image.name, second.image.name)
+        self.assertEqual(len(self.files()), 1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            first.delete()
+        self.assertEqual(len(self.files()), 1)  # на файл ещё ссылается второй товар
+        with self.captureOnCommitCallbacks(execute=True):
+            second.delete()
+        self.assertEqual(self.files(), [])
+        self.assertFalse(hashed_storage.exists(get_thumbnail_name(second.image.name, 100)))
+
+    def test_dedupe_command_collapses_old_copies(self):
+        os.makedirs(os.path.join(self.media, 'products'))
+        for name in ['product1.png', 'product1_6CGxB66.png']:
+            with open(os.path.join(self.media, 'products', name), 'wb') as file:
+                file.write(self.content)
+        Gallery.objects.filter(product=self.products[0]).update(image='products/product1.png')
+        Gallery.objects.filter(product=self.products[1]).update(image='products/product1_6CGxB66.png')
+
+        out = io.StringIO()
+        call_command('dedupe_media', stdout=out)
+        self.assertIn('лишних копий: 1', out.getvalue())
+        self.assertIn(f'освобождено {len(self.content) / 1024:.0f} КБ', out.getvalue())
+        self.assertEqual(len(self.files()), 1)
+        self.assertEqual(set(Gallery.objects.values_list('image', flat=True)), {f'products/{self.files()[0]}'})
+
+
+class AdminChangelistTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        create_catalog(categories=2, subcategories=2, products=1)
+        self.client.force_login(User.objects.create_superuser('admin', password='secret'))
+
+    def add_products(self, count):
+        categories = list(Category.objects.exclude(parent=None))
+        Product.objects.bulk_create([Product(title=f'bulk{i}', slug=f'bulk{i}', price=i, photo_url=f'/media/{i}.png',
+                                             thumbnail_url=f'/media/{i}.webp', category=categories[i % len(categories)])
+                                     for i in range(count)])
+
+    def test_product_changelist_page_of_1000_rows(self):
+        url = reverse('admin:store_product_changelist')
+        with patch.object(ProductAdmin, 'list_per_page', 1000):
+            small = count_queries(self.client, url)
+            self.add_products(1000)
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(url, {'price_range': '-1000'})
+        self.assertEqual(len(response.context['cl'].result_list), 1000)
+        self.assertEqual(len(queries), small)
+        self.assertFalse([q for q in queries if 'store_gallery' in q['sql']])
+
+    def test_category_changelist_counts_products(self):
+        url = reverse('admin:store_category_changelist')
+        small = count_queries(self.client, url)
+        self.add_products(1000)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(len(queries), small)
+        counts = {category.slug: category.products_count for category in response.context['cl'].result_list}
+        self.assertEqual(counts['c0-0'], 251)
+        self.assertEqual(counts['c0'], 0)
+
+
+class FakeStripe(BaseHTTPRequestHandler):  # локальная замена api.stripe.com: создаёт сессии Checkout
+    def do_POST(self):
+        body = parse_qs(self.rfile.read(int(self.headers['Content-Length'])).decode())
+        key = self.headers.get('Idempotency-Key')
+        self.server.requests.append((self.path, key, body))
+        if key not in self.server.sessions:  # как Stripe: повтор с тем же ключом возвращает тот же ответ
+            number = len(self.server.sessions)
+            self.server.sessions[key] = (body, {'id': f'cs_test_{number}', 'object': 'checkout.session',
+                                                'url': f'https://checkout.stripe.test/{number}'})
+        first_body, session = self.server.sessions[key]
+        status = 200
+        if body != first_body:  # тот же ключ с другими параметрами Stripe отклоняет
+            status, session = 400, {'error': {'type': 'idempotency_error', 'message': 'Keys for idempotent requests '
+                                              'can only be used with the same parameters they were first used with.'}}
+        response = json.dumps(session).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(response)))
+        self.end_headers()
+        self.wfile.write(response)
+
+    def log_message(self, *args):
+        pass
+
+
+@override_settings(STRIPE_WEBHOOK_SECRET='whsec_test')
+class StripeCheckoutTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        create_catalog(categories=1, subcategories=1, products=2)
+        self.user = User.objects.create_user('buyer', password='secret')
+        self.client.force_login(self.user)
+        for product in Product.objects.all():
+            self.client.get(reverse('to_cart', args=[product.pk, 'add']))
+
+        server = ThreadingHTTPServer(('127.0.0.1', 0), FakeStripe)
+        server.requests, server.sessions = [], {}
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        self.stripe = server
+        api_base = patch.object(stripe, 'api_base', f'http://127.0.0.1:{server.server_address[1]}')
+        api_base.start()
+        self.addCleanup(api_base.stop)
+
+    def pay(self):
+        return self.client.post(reverse('payment'), {'first_name': 'Иван', 'last_name': 'Петров'})
+
+    def send_event(self, session, secret='whsec_test'):
+        payload = json.dumps({'id': 'evt_1', 'object': 'event', 'type': 'checkout.session.completed',
+                              'data': {'object': session}})
+        timestamp = int(time.time())
+        signature = hmac.new(secret.encode(), f'{timestamp}.{payload}'.encode(), hashlib.sha256).hexdigest()
+        return self.client.post(reverse('stripe_webhook'), payload, content_type='application/json',
+                                HTTP_STRIPE_SIGNATURE=f't={timestamp},v1={signature}')
+
+    def paid_session(self, order, amount=2100):  # две штуки по 10 и 11
+        return {'id': order.stripe_session_id, 'object': 'checkout.session', 'payment_status': 'paid',
+                'client_reference_id': str(order.pk), 'amount_total': amount}
+
+    def test_checkout_reuses_session_until_cart_changes(self):
+        response = self.pay()
+        self.assertRedirects(response, 'https://checkout.stripe.test/0', 303, fetch_redirect_response=False)
+        self.pay()
+        path, key, body = self.stripe.requests[0]
+        self.assertEqual(path, '/v1/checkout/sessions')
+        self.assertEqual(body['line_items[0][price_data][unit_amount]'], ['1000'])
+        self.assertEqual(body['line_items[1][price_data][unit_amount]'], ['1100'])
+        self.assertEqual(self.stripe.requests[1][1], key)  # двойной клик - та же сессия
+        self.assertEqual(Order.objects.get().stripe_session_id, 'cs_test_0')
+
+        self.client.get(reverse('to_cart', args=[Product.objects.first().pk, 'add']))
+        self.pay()
+        self.assertNotEqual(self.stripe.requests[2][1], key)
+        self.assertEqual(User.objects.get(pk=self.user.pk).first_name, 'Иван')
+
+    def test_checkout_from_other_language_gets_own_session(self):
+        self.pay()
+        with translation.override('en'):
+            response = self.client.post(reverse('payment'), {'first_name': 'Иван', 'last_name': 'Петров'})
+        self.assertRedirects(response, 'https://checkout.stripe.test/1', 303, fetch_redirect_response=False)
+        self.assertEqual(self.stripe.requests[1][2]['success_url'], ['http://testserver/en/payment_success/'])
+        self.assertNotEqual(self.stripe.requests[1][1], self.stripe.requests[0][1])
+
+    def test_stripe_error_returns_to_checkout(self):
+        with patch('store.payments.get_idempotency_key', return_value='order-fixed'):
+            self.pay()
+            self.client.get(reverse('to_cart', args=[Product.objects.first().pk, 'add']))
+            response = self.pay()  # ключ тот же, параметры другие - Stripe отвечает ошибкой
+        self.assertRedirects(response, reverse('checkout'), fetch_redirect_response=False)
+        self.assertEqual(self.client.get(reverse('checkout')).status_code, 200)
+        self.assertEqual(Order.objects.get().stripe_session_id, 'cs_test_0')
+
+    def test_webhook_completes_order_once(self):
+        self.pay()
+        self.client.get(reverse('success'))
+        order = Order.objects.get()
+        self.assertFalse(order.is_completed)  # страница успеха сама ничего не закрывает
+        self.assertEqual(order.orderproduct_set.count(), 2)
+        stock = list(Product.objects.values_list('quantity', flat=True))
+
+        self.assertEqual(self.send_event(self.paid_session(order), secret='whsec_wrong').status_code, 400)
+        self.assertFalse(Order.objects.get().is_completed)
+
+        self.assertEqual(self.send_event(self.paid_session(order)).status_code, 200)
+        self.assertEqual(self.send_event(self.paid_session(order)).status_code, 200)  # Stripe повторил событие
+        archived = ArchivedOrder.objects.get()  # оплаченный заказ ушёл в архив ровно один раз
+        self.assertEqual((archived.order_id, archived.total_cents), (order.pk, 2100))
+        self.assertIsNotNone(archived.paid_at)
+        self.assertFalse(Order.objects.filter(pk=order.pk).exists())
+        self.assertEqual(list(Product.objects.values_list('quantity', flat=True)), stock)
+
+        response = self.client.get(reverse('cart'))  # новая корзина пуста
+        self.assertEqual(response.context['cart_total_quantity'], 0)
+
+    def test_webhook_flags_mismatched_amount(self):
+        self.pay()
+        order = Order.objects.get()
+        with self.assertLogs('store.payments', 'ERROR'):
+            self.assertEqual(self.send_event(self.paid_session(order, amount=1000)).status_code, 200)
+        self.assertFalse(Order.objects.get(pk=order.pk).is_completed)
+        checkout = CheckoutSession.objects.get()  # оплата не потерялась, её разберёт менеджер
+        self.assertEqual((checkout.status, checkout.amount_paid_cents), ('review', 1000))
+
+    def test_cart_changed_after_checkout(self):
+        self.pay()
+        order = Order.objects.get()
+        first, second = Product.objects.order_by('pk')
+        self.client.get(reverse('to_cart', args=[first.pk, 'add']))  # пока вебхук ещё не пришёл
+        self.assertEqual(self.send_event(self.paid_session(order)).status_code, 200)
+
+        archived = ArchivedOrder.objects.get()  # закрыт ровно оплаченный снимок
+        self.assertEqual((archived.total_cents, archived.total_quantity), (2100, 2))
+        self.assertEqual(CheckoutSession.objects.get().status, 'fulfilled')
+        cart = Order.objects.get(is_completed=False)  # неоплаченный товар остался в новой корзине
+        self.assertEqual(list(cart.orderproduct_set.values_list('product_id', 'quantity')), [(first.pk, 1)])
+
+
+class LineItemsTest(TestCase):
+    def setUp(self):
+        create_catalog(categories=1, subcategories=1, products=0)
+        self.category = Category.objects.get(slug='c0-0')
+        self.customer = Customer.objects.create()
+        self.order = Order.objects.create(customer=self.customer)
+
+    def add_lines(self, count, price='19.99'):
+        products = Product.objects.bulk_create([Product(title=f'p{i}', slug=f'p{i}', price=price, category=self.category)
+                                                for i in range(count)])
+        OrderProduct.objects.bulk_create([OrderProduct(order=self.order, product=product, quantity=2)
+                                          for product in products])
+
+    def test_one_item_per_line_in_exact_cents(self):
+        self.add_lines(3)
+        with self.assertNumQueries(1):
+            lines, total = get_cart_snapshot(self.order)
+            line_items = build_line_items(lines)
+        self.assertEqual([item['price_data']['unit_amount'] for item in line_items], [1999] * 3)  # float дал бы 1998
+        self.assertEqual([item['quantity'] for item in line_items], [2] * 3)
+        self.assertEqual(total, 3 * 2 * 1999)
+
+    def test_long_cart_fits_stripe_limit(self):
+        self.add_lines(150)
+        lines, total = get_cart_snapshot(self.order)
+        line_items = build_line_items(lines)
+        self.assertEqual(len(line_items), MAX_LINE_ITEMS)
+        self.assertEqual(sum(item['price_data']['unit_amount'] * item['quantity'] for item in line_items), total)
+
+
+class OrderArchiveTest(TestCase):
+    def setUp(self):
+        create_catalog(categories=1, subcategories=1, products=2)
+        self.user = User.objects.create_user('buyer', password='secret')
+        self.request = SimpleNamespace(user=self.user)
+        self.cart = CartForAuthenticatedUser(self.request)
+        for product in Product.objects.all():
+            self.cart.add_or_delete(product.pk, 'add')
+
+    def test_snapshot_keeps_price_at_purchase(self):
+        order = self.cart.get_order()
+        City.objects.create(city_name='Ташкент')
+        ShippingAddress.objects.create(customer=order.customer, order=order, address='ул. 1', region='Ташкент',
+                                       phone='123', city=City.objects.get())
+        Order.objects.filter(pk=order.pk).update(is_completed=True)
+        call_command('archive_orders', stdout=io.StringIO())
+        Product.objects.update(price=99)
+
+        archived = ArchivedOrder.objects.get()
+        self.assertEqual([item['price_cents'] for item in archived.items], [1000, 1100])
+        self.assertEqual(archived.shipping['city'], 'Ташкент')
+        self.assertFalse(OrderProduct.objects.exists())
+        self.assertNotEqual(self.cart.get_order().pk, order.pk)  # следующая покупка - новая корзина
+
+    def test_active_cart_lookup_uses_partial_index(self):
+        customer = self.cart.get_order().customer
+        Order.objects.bulk_create([Order(customer=customer, is_completed=True) for _ in range(50)])
+        with self.assertNumQueries(2):
+            order = self.cart.get_order()
+        with connection.cursor() as cursor:
+            sql, params = Order.objects.filter(customer=customer, is_completed=False).query.sql_with_params()
+            cursor.execute(f'EXPLAIN QUERY PLAN {sql}', params)
+            plan = ' '.join(row[-1] for row in cursor.fetchall())
+        self.assertIn('unique_active_cart', plan)
+        self.assertEqual(order.get_cart_total_quantity, 2)
+
+
+class CatalogImportExportTest(TestCase):
+    def setUp(self):
+        create_catalog(categories=1, subcategories=2, products=3)
+        Product.objects.filter(slug='c0-0-0').update(title_en='Ring', description_en='Silver ring')
+
+    def export(self, format):
+        out = io.StringIO()
+        call_command('export_catalog', format=format, stdout=out)
+        out.seek(0)
+        return out
+
+    def import_(self, stream, format, **options):
+        with patch('sys.stdin', stream):
+            call_command('import_catalog', '-', format=format, stdout=io.StringIO(), **options)
+
+    def snapshot(self):
+        return sorted((product.slug, product.title_ru, product.title_en, product.description_en, product.price,
+                       product.category.slug, product.category.parent.slug,
+                       tuple(product.images.order_by('pk').values_list('image', flat=True)))
+                      for product in Product.objects.select_related('category__parent'))
+
+    def test_round_trip(self):
+        for format in ('csv', 'jsonl'):
+            before = self.snapshot()
+            stream = self.export(format)
+            Category.objects.all().delete()
+            self.import_(stream, format, batch_size=4)
+            self.assertEqual(self.snapshot(), before)
+            self.assertEqual(Product.objects.get(slug='c0-0-0').title, 'c0-0-0')
+            product = Product.objects.get(slug='c0-0-0')
+            self.assertTrue(product.photo_url.endswith('products/c000-1.png'))
+            self.assertEqual((product.thumbnail_url, product.photo_srcset), (product.photo_url, ''))  # копии - потом
+        self.assertEqual([product.slug for product in SearchResults('Ring')], ['c0-0-0'])
+
+    def test_import_updates_existing_products_in_batches(self):
+        rows = [json.loads(line) for line in self.export('jsonl')]
+        for row in rows:
+            row['price'] = '99.90'
+        rows[0]['category'] = 'c0-1'  # товар переезжает в другую категорию
+        moved = Product.objects.get(slug=rows[0]['slug'])
+        new_category = Category.objects.get(slug='c0-1')
+        get_related_pool(moved.category_id), get_related_pool(new_category.pk)
+        stream = io.StringIO(''.join(json.dumps(row) + '\n' for row in rows))
+        with CaptureQueriesContext(connection) as queries:
+            self.import_(stream, 'jsonl')
+        self.assertLess(len(queries), 20)  # запросов на пачку, а не на строку
+        self.assertEqual(Product.objects.count(), 6)
+        self.assertEqual(set(Product.objects.values_list('price', flat=True)), {Decimal('99.90')})
+        self.assertEqual(Gallery.objects.count(), 12)  # уже привязанные фото не дублируются
+        self.assertNotIn(moved.pk, get_related_pool(moved.category_id))
+        self.assertIn(moved.pk, get_related_pool(new_category.pk))
+
+
+@override_settings(WAREHOUSE_API_TOKEN='warehouse-token')
+class StockUpdateTest(TestCase):
+    def setUp(self):
+        create_catalog(categories=1, subcategories=1, products=3)  # c0-0-0..2: цены 10, 11, 12, остаток 5
+
+    def post(self, items, token='warehouse-token'):
+        return self.client.post(reverse('stock_update'), json.dumps(items), content_type='application/json',
+                                HTTP_AUTHORIZATION=f'Bearer {token}')
+
+    def test_requires_token(self):
+        self.assertEqual(self.post([{'slug': 'c0-0-0', 'quantity': 0}], token='wrong').status_code, 401)
+        with override_settings(WAREHOUSE_API_TOKEN=''):
+            self.assertEqual(self.post([{'slug': 'c0-0-0', 'quantity': 0}], token='').status_code, 401)
+        self.assertEqual(Product.objects.get(slug='c0-0-0').quantity, 5)
+
+    def test_bulk_update_reports_each_row(self):
+        before = dict(Product.objects.values_list('slug', 'updated_at'))
+        response = self.post({'items': [
+            {'slug': 'c0-0-0', 'quantity': 7, 'price': '19.99'},
+            {'slug': 'c0-0-1', 'quantity': 5},
+            {'slug': 'c0-0-2', 'price': 15},
+            {'slug': 'missing', 'quantity': 1},
+            {'slug': 'c0-0-1', 'price': '1.005'},
+            {'quantity': 3},
+            {'slug': 'c0-0-2', 'quantity': 10 ** 30},
+        ]})
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual([result['status'] for result in data['results']],
+                         ['updated', 'unchanged', 'updated', 'not_found', 'invalid', 'invalid', 'invalid'])
+        self.assertEqual(data['counts'], {'updated': 2, 'unchanged': 1, 'not_found': 1, 'invalid': 3})
+
+        products = {product.slug: product for product in Product.objects.all()}
+        self.assertEqual((products['c0-0-0'].quantity, products['c0-0-0'].price), (7, Decimal('19.99')))
+        self.assertEqual((products['c0-0-2'].quantity, products['c0-0-2'].price), (5, Decimal('15')))
+        self.assertEqual(products['c0-0-1'].updated_at, before['c0-0-1'])  # кеш карточки не сброшен зря
+        self.assertNotEqual(products['c0-0-0'].updated_at, before['c0-0-0'])
+
+    def test_queries_do_not_grow_with_batch(self):
+        items = [{'slug': slug, 'quantity': 100, 'price': '9.50'} for slug in
+                 Product.objects.values_list('slug', flat=True)]
+        with CaptureQueriesContext(connection) as queries:
+            self.post(items)
+        self.assertLess(len(queries), 8)
+
+    def test_command(self):
+        with tempfile.NamedTemporaryFile('w', suffix='.csv', delete=False, encoding='utf-8') as stream:
+            stream.write('slug,quantity,price\nc0-0-0,0,\nc0-0-1,,abc\n')
+        self.addCleanup(os.remove, stream.name)
+        out, err = io.StringIO(), io.StringIO()
+        call_command('update_stock', stream.name, stdout=out, stderr=err)
+        self.assertIn('Обновлено: 1', out.getvalue())
+        self.assertIn('строка 2: c0-0-1', err.getvalue())
+        self.assertEqual(Product.objects.get(slug='c0-0-0').quantity, 0)
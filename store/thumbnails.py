@@ -0,0 +1,79 @@
+import os
+from io import BytesIO
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from PIL import Image
+
+# Уменьшенные копии фото товаров в WebP: карточки, корзина и слайдер берут нужную ширину
+# через srcset вместо исходного PNG. Копии делаются при загрузке фото, а для старых файлов -
+# при первом обращении, и дальше лежат на диске рядом с media/products
+
+THUMBNAIL_WIDTHS = (100, 200, 300, 600)
+THUMBNAIL_FORMAT = 'WEBP'
+THUMBNAIL_QUALITY = 80
+CARD_WIDTH = 300  # ширина фото в карточке товара
+
+
+def get_thumbnail_name(name, width):
+    stem = os.path.splitext(name)[0]
+    return f'thumbnails/{stem}-{width}w.webp'
+
+
+def make_thumbnails(name, widths=THUMBNAIL_WIDTHS, storage=default_storage):
+    with storage.open(name) as source:
+        original = Image.open(source)
+        original.load()
+    if original.mode not in ('RGB', 'RGBA'):
+        original = original.convert('RGBA')
+    for width in widths:
+        image = original.copy()
+        image.thumbnail((width, width * 10))  # по ширине, исходник не растягиваем
+        buffer = BytesIO()
+        image.save(buffer, THUMBNAIL_FORMAT, quality=THUMBNAIL_QUALITY)
+        thumbnail_name = get_thumbnail_name(name, width)
+        if storage.exists(thumbnail_name):  # иначе storage допишет к имени случайный суффикс
+            storage.delete(thumbnail_name)
+        storage.save(thumbnail_name, ContentFile(buffer.getvalue()))
+
+
+def ensure_thumbnails(name, storage=default_storage):
+    if all(storage.exists(get_thumbnail_name(name, width)) for width in THUMBNAIL_WIDTHS):
+        return True
+    try:
+        make_thumbnails(name, storage=storage)
+    except (OSError, ValueError):  # исходника нет или это не картинка - отдаём как есть
+        return False
+    return True
+
+
+def get_thumbnail_url(name, width, storage=default_storage):
+    if not ensure_thumbnails(name, storage):
+        return storage.url(name)
+    return storage.url(get_thumbnail_name(name, width))
+
+
+def get_srcset(name, storage=default_storage):
+    if not ensure_thumbnails(name, storage):
+        return ''
+    return ', '.join(f'{storage.url(get_thumbnail_name(name, width))} {width}w' for width in THUMBNAIL_WIDTHS)
+
+
+def get_photo_urls(name, storage=default_storage):
+    # Ссылки без уменьшенных копий: исходник и в карточке. Файлов не касается, поэтому подходит
+    # для массовой загрузки; копии потом делает manage.py make_thumbnails
+    url = storage.url(name) if name else ''
+    return {'photo_url': url, 'thumbnail_url': url, 'photo_srcset': ''}
+
+
+def get_photo_fields(name, storage=default_storage):
+    # Ссылки на первое фото, которые хранятся прямо в Product: карточкам не нужен запрос к Gallery
+    if not name or not ensure_thumbnails(name, storage):  # проверяем копии один раз на фото, а не на каждую ссылку
+        return get_photo_urls(name, storage)
+    url = storage.url(name)
+    return {
+        'photo_url': url,
+        'thumbnail_url': storage.url(get_thumbnail_name(name, CARD_WIDTH)),
+        'photo_srcset': ', '.join(f'{storage.url(get_thumbnail_name(name, width))} {width}w'
+                                  for width in THUMBNAIL_WIDTHS),
+    }
@@ -5,6 +5,8 @@ urlpatterns = [
         path('', ProductList.as_view(), name='product_list'),
         path('category/<slug:slug>/', CategoryView.as_view(), name='category_detail'),
         path('product/<slug:slug>/', ProductDetail.as_view(), name='product_detail'),
+        path('search/', SearchView.as_view(), name='search'),
+        path('autocomplete/', autocomplete_products, name='autocomplete'),
         path('login_registration/', login_registration, name='login_registration'),
 
         path('login', user_login, name='login'),
@@ -22,4 +24,6 @@ urlpatterns = [
 
         path('payment/', create_checkout_session, name='payment'),
         path('payment_success/', successPayment, name='success'),
+        path('stripe_webhook/', stripe_webhook, name='stripe_webhook'),
+        path('api/stock/', stock_update, name='stock_update'),
 ]
\ No newline at end of file
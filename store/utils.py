@@ -1,3 +1,7 @@
+import json
+
+from django.db import transaction
+from django.db.models import F, Case, When
 from .models import Product, OrderProduct, Order, Customer
 
 # Класс который будит отвечать за всю корзину, создавать и возвращать данные
@@ -11,12 +15,16 @@ class CartForAuthenticatedUser:
 
 
 
-    # Метод который будит возвращать информацию о корзине
-    def get_cart_info(self):
+    def get_order(self):
         customer, created = Customer.objects.get_or_create(user=self.user)  # Если есть покупатель получить, если нет то создать
+        # Если есть незакрытый заказ получить, если нет то создать (оплаченные закрывает вебхук Stripe)
+        order, created = Order.objects.get_or_create(customer=customer, is_completed=False)
+        return order
 
-        order, created = Order.objects.get_or_create(customer=customer)  # Если есть заказ получить, если нет то создать
-        order_products = order.orderproduct_set.all()  # получаем все продукты заказа
+    # Метод который будит возвращать информацию о корзине
+    def get_cart_info(self):
+        order = self.get_order()
+        order_products = order.orderproduct_set.select_related('product')  # получаем все продукты заказа
 
         cart_total_quantity = order.get_cart_total_quantity
         cart_total_price = order.get_cart_total_price
@@ -29,26 +37,26 @@ class CartForAuthenticatedUser:
             'order': order
         }
 
+    # Остаток на складе и количество в корзине меняем условными UPDATE с F() в одной транзакции:
+    # параллельные клики не теряют обновления и не уводят склад в минус
     def add_or_delete(self, product_id, action):
-        order = self.get_cart_info()['order']  # Получаем заказ
-        product = Product.objects.get(pk=product_id)  # получаем продукт
-        order_product, created = OrderProduct.objects.get_or_create(order=order, product=product)
-
-        if action == 'add' and product.quantity > 0:
-            order_product.quantity += 1
-            product.quantity -= 1
-        else:
-            order_product.quantity -= 1
-            product.quantity += 1
-        product.save()
-        order_product.save()
+        order = self.get_order()  # Получаем заказ
+        order_products = OrderProduct.objects.filter(order=order, product_id=product_id)
 
-        if order_product.quantity <= 0:
-            order_product.delete()
+        with transaction.atomic():
+            if action == 'add':
+                reserved = Product.objects.filter(pk=product_id, quantity__gt=0).update(quantity=F('quantity') - 1)
+                if reserved and not order_products.update(quantity=F('quantity') + 1):
+                    OrderProduct.objects.create(order=order, product_id=product_id, quantity=1)
+            else:
+                returned = order_products.filter(quantity__gt=0).update(quantity=F('quantity') - 1)
+                if returned:
+                    Product.objects.filter(pk=product_id).update(quantity=F('quantity') + 1)
+                    order_products.filter(quantity__lte=0).delete()
 
 
     def clear(self):
-        order = self.get_cart_info()['order']  # Получаем заказ
+        order = self.get_order()  # Получаем заказ
         order_products = order.orderproduct_set.all()
         for product in order_products:
             product.delete()
@@ -57,9 +65,156 @@ class CartForAuthenticatedUser:
 
 
 
+# ----------------------------------------------------------------------------------------
+# Корзина гостя живёт в отдельной подписанной cookie вида {'id товара': количество}, сессии не трогает:
+# до оформления заказа база не меняется, склад резервируется только при входе в аккаунт.
+# Корзина за запрос читается один раз и хранится на request, изменённую в ответ пишет GuestCartMiddleware
+
+CART_COOKIE_NAME = 'cart'
+CART_COOKIE_SALT = 'store.cart'
+CART_COOKIE_AGE = 60 * 60 * 24 * 30
+
+
+class SessionCartItem:  # строка корзины с тем же интерфейсом, что у OrderProduct
+    def __init__(self, product, quantity):
+        self.product = product
+        self.quantity = quantity
+
+    @property
+    def get_total_price(self):
+        return self.product.price * self.quantity
+
+
+class SessionOrder:  # заказ гостя с тем же интерфейсом, что у Order
+    def __init__(self, items):
+        self.items = items
+
+    @property
+    def get_cart_total_price(self):
+        return sum(item.get_total_price for item in self.items)
+
+    @property
+    def get_cart_total_quantity(self):
+        return sum(item.quantity for item in self.items)
+
+
+def read_cart_cookie(request):
+    if not hasattr(request, '_guest_cart'):
+        value = request.get_signed_cookie(CART_COOKIE_NAME, default=None, salt=CART_COOKIE_SALT)
+        try:
+            cart = json.loads(value) if value else {}
+        except ValueError:
+            cart = {}
+        # подпись не спасает от старого формата: берём только пары "id": количество
+        request._guest_cart = {key: quantity for key, quantity in cart.items()
+                               if key.isdigit() and isinstance(quantity, int) and quantity > 0} \
+            if isinstance(cart, dict) else {}
+        request._guest_cart_changed = False
+    return request._guest_cart
+
+
+def write_cart_cookie(request, cart):
+    request._guest_cart = cart
+    request._guest_cart_changed = True
+
+
+def save_cart_cookie(request, response):
+    if not getattr(request, '_guest_cart_changed', False):
+        return
+    if request._guest_cart:
+        response.set_signed_cookie(CART_COOKIE_NAME, json.dumps(request._guest_cart, separators=(',', ':')),
+                                   salt=CART_COOKIE_SALT, max_age=CART_COOKIE_AGE, httponly=True, samesite='Lax')
+    else:
+        response.delete_cookie(CART_COOKIE_NAME, samesite='Lax')
+
+
+class GuestCartMiddleware:  # пишет изменённую корзину гостя в cookie ответа
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        save_cart_cookie(request, response)
+        return response
+
+
+class CartForAnonymousUser:
+    def __init__(self, request, product_id=None, action=None):
+        self.request = request
+
+        if product_id and action:
+            self.add_or_delete(product_id, action)
+
+    @property
+    def cart(self):
+        return read_cart_cookie(self.request)
+
+    def get_cart_info(self):
+        cart = self.cart
+        products = Product.objects.filter(pk__in=cart).in_bulk()
+        items = [SessionCartItem(products[int(pk)], quantity)
+                 for pk, quantity in cart.items() if int(pk) in products]
+        order = SessionOrder(items)
+
+        return {
+            'cart_total_quantity': order.get_cart_total_quantity,
+            'cart_total_price': order.get_cart_total_price,
+            'products': items,
+            'order': order
+        }
+
+    def add_or_delete(self, product_id, action):
+        cart = dict(self.cart)
+        key = str(product_id)
+        quantity = cart.get(key, 0)
+
+        if action == 'add':
+            stock = Product.objects.filter(pk=product_id).values_list('quantity', flat=True).first() or 0
+            if quantity < stock:
+                cart[key] = quantity + 1
+        elif quantity > 1:
+            cart[key] = quantity - 1
+        else:
+            cart.pop(key, None)
+        write_cart_cookie(self.request, cart)
+
+    def clear(self):
+        write_cart_cookie(self.request, {})
+
+
+def merge_session_cart(request):  # переносим корзину гостя в заказ после входа
+    cart = read_cart_cookie(request)
+    if not cart:
+        return
+    write_cart_cookie(request, {})  # cookie удалится в ответе на вход
+
+    order = CartForAuthenticatedUser(request).get_order()  # login() уже записал пользователя в request
+    with transaction.atomic():
+        stock = dict(Product.objects.filter(pk__in=cart, quantity__gt=0).values_list('pk', 'quantity'))
+        reserve = {pk: min(cart[str(pk)], quantity) for pk, quantity in stock.items()}
+        if not reserve:
+            return
+
+        existing = {line.product_id: line for line in order.orderproduct_set.filter(product_id__in=reserve)}
+        for pk, line in existing.items():
+            line.quantity += reserve[pk]
+        OrderProduct.objects.bulk_update(existing.values(), ['quantity'])
+        OrderProduct.objects.bulk_create([OrderProduct(order=order, product_id=pk, quantity=quantity)
+                                          for pk, quantity in reserve.items() if pk not in existing])
+        Product.objects.filter(pk__in=reserve).update(
+            quantity=Case(*[When(pk=pk, then=F('quantity') - quantity) for pk, quantity in reserve.items()])
+        )
+
+
+def get_cart(request, product_id=None, action=None):  # выбираем корзину в зависимости от пользователя
+    if request.user.is_authenticated:
+        return CartForAuthenticatedUser(request, product_id, action)
+    return CartForAnonymousUser(request, product_id, action)
+
+
 def get_cart_data(request):
 
-    cart = CartForAuthenticatedUser(request)
+    cart = get_cart(request)
     cart_info = cart.get_cart_info()
 
     return {
@@ -68,7 +223,3 @@ def get_cart_data(request):
         'order': cart_info['order'],
         'products': cart_info['products']
     }
-
-
-
-
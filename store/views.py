@@ -1,86 +1,120 @@
+import json
+
+import stripe
 from django.contrib.auth.mixins import LoginRequiredMixin
 from django.contrib.auth.models import User
+from django.db import IntegrityError, transaction
+from django.http import HttpResponse, JsonResponse
 from django.shortcuts import render, redirect
+from django.utils.translation import get_language
 from django.urls import reverse
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST
 from django.views.generic import ListView, DetailView
-from .models import Category, Product, Review,FavoriteProducts, Mail, Customer, Order, OrderProduct, ShippingAddress
-from random import randint
+from .models import Category, Product, Review,FavoriteProducts, Mail, MailCampaign, Customer
 from .forms import LoginForm, RegistrationForm, ReviewForm, CustomerForm, ShippingForm
 from django.contrib.auth import login, logout
 from django.contrib import messages
-from shop import settings
-from django.core.mail import send_mail
-from .utils import CartForAuthenticatedUser, get_cart_data
-import stripe
+from .utils import CartForAuthenticatedUser, get_cart, get_cart_data
+from .catalog import get_catalog_tree, get_category_tree, get_related_products
+from .pagination import KeysetPaginationMixin
+from .facets import FacetFilter
+from .mailing import queue_campaign
+from .search import SearchResults
+from .autocomplete import get_index as get_autocomplete_index
+from .payments import (get_cart_snapshot, get_webhook_event, fulfil_order,
+                       create_checkout_session as create_checkout_session_for_order)
+from .stock import MAX_STOCK_UPDATES, check_token, apply_stock_updates, count_results
 
 # Create your views here.
 
 class ProductList(ListView):
-    model = Product
-    # context_object_name = 'categories'
+    model = Category
+    context_object_name = 'categories'
 
     extra_context = {
         'title': 'TOTEMBO: Главная страница'
     }
     template_name = 'store/product_list.html'
 
-    # def get_queryset(self):
-    #     categories = Category.objects.filter(parent=None)
-    #     return categories
+    def get_queryset(self):
+        return get_catalog_tree()  # категории вместе с подкатегориями, товарами и фото
 
 
 
-class CategoryView(ListView):
+class CategoryView(KeysetPaginationMixin, ListView):
     model = Product
     context_object_name = 'products'
     template_name = 'store/category_page.html'  # указываем для какой страницы написана Вьюшка
     paginate_by = 1   # говорим по сколько товаров будит на странице
 
     def get_queryset(self):
-        sort_field = self.request.GET.get('sort')  # для сортировки по цвету, материалу, цене
+        # сортировку по цвету, материалу, цене делает пагинация по курсору (KeysetPaginationMixin)
+        self.category = Category.objects.get(slug=self.kwargs['slug'])
+        self.facet_filter = FacetFilter(self.request.GET)  # цена, цвет, размер, наличие
         type_field = self.request.GET.get('type')  # для сортировки по подкатегориям
         if type_field:   # проверка на получение кокретного продукта по ключу slug
-            products = Product.objects.filter(category__slug=type_field)
-            return products
-
-        main_category = Category.objects.get(slug=self.kwargs['slug'])
-        subcategories = main_category.subcategories.all()
-        products = Product.objects.filter(category__in=subcategories)
+            self.products = Product.objects.filter(category__slug=type_field)
+        else:
+            self.subcategory_ids = [sub.pk for sub in get_category_tree()['children'].get(self.category.pk, [])]
+            self.products = Product.objects.filter(category__in=self.subcategory_ids)
+        return self.facet_filter.filter(self.products)
 
-        if sort_field:
-            products = products.order_by(sort_field)
-        return products
+    def get_keyset_partitions(self, queryset):
+        # Товары каждой подкатегории идут по индексу (category, поле сортировки) без сортировки в памяти
+        if self.request.GET.get('type'):
+            return [queryset]
+        return [queryset.filter(category_id=pk) for pk in self.subcategory_ids]
 
         # метод Динамического возврата данных
     def get_context_data(self, *, object_list=None, **kwargs):
          context = super().get_context_data()
-         main_category = Category.objects.get(slug=self.kwargs['slug'])
-         context['category'] = main_category
-         context['title'] = f'Категория: {main_category.title}'
+         context['category'] = self.category
+         context['facets'] = self.facet_filter.describe(self.products)  # счётчики для панели фильтров
+         context['title'] = f'Категория: {self.category.title}'
          return context
 
 
 
+class SearchView(ListView):  # search.html
+    context_object_name = 'products'
+    template_name = 'store/search.html'
+    paginate_by = 12
+
+    def get_queryset(self):
+        return SearchResults(self.request.GET.get('q', ''))  # ищет по FTS-индексу, а не перебором таблицы
+
+    def get_context_data(self, *, object_list=None, **kwargs):
+        context = super().get_context_data()
+        context['q'] = self.request.GET.get('q', '')
+        context['title'] = f'Поиск: {context["q"]}'
+        return context
+
+
+
+def autocomplete_products(request):  # подсказки для строки поиска, без запросов к базе
+    language = get_language() or 'ru'
+    found = get_autocomplete_index().search(request.GET.get('q', ''), language[:2], limit=10)
+    results = [{
+        'title': titles.get(language[:2]) or next(iter(titles.values())),
+        'url': reverse('product_detail', kwargs={'slug': slug})
+    } for pk, slug, titles in found]
+    return JsonResponse({'results': results})
+
+
+
 class ProductDetail(DetailView):  # product_detail.html
     model = Product
     context_object_name = 'product'
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data()
-        product = Product.objects.get(slug=self.kwargs['slug'])
+        product = self.object  # DetailView уже получил товар по slug
         context['title'] = f'Товар: {product.title}'
 
+        context['products'] = get_related_products(product, count=4)
 
-        products = Product.objects.all()
-        data = []
-        for i in range(4):
-            random_index = randint(0, len(products)-1)
-            p = products[random_index]
-            if p not in data:
-                data.append(p)
-        context['products'] = data
-
-        context['reviews'] = Review.objects.filter(product=product)
+        context['reviews'] = Review.objects.filter(product=product).select_related('author')
 
 
         if self.request.user.is_authenticated:
@@ -146,15 +180,17 @@ def save_review(request, product_id):
 
 def save_favourite_product(request, product_slug):
     user = request.user if request.user.is_authenticated else None
-    product = Product.objects.get(slug=product_slug)
-    favourite_products = FavoriteProducts.objects.filter(user=user)
     if user:
-        if product in [i.product for i in favourite_products]:
-            fav_product = FavoriteProducts.objects.get(user=user, product=product)
+        product = Product.objects.get(slug=product_slug)
+        deleted, _ = FavoriteProducts.objects.filter(user=user, product=product).delete()  # если был в избранном - убираем
+        if deleted:
             messages.warning(request, 'Продукт удалён из избранного')
-            fav_product.delete()
         else:
-            FavoriteProducts.objects.create(user=user, product=product)
+            try:
+                with transaction.atomic():
+                    FavoriteProducts.objects.create(user=user, product=product)
+            except IntegrityError:
+                pass  # двойной клик: второй запрос уже добавил товар, результат тот же
             messages.success(request, 'Продукт успешно добавлен в Избранное')
     else:
         messages.warning(request, 'Что бы добавить в Избранное Войдите в Аккаунт или Зарегистрируйтесь')
@@ -170,18 +206,15 @@ class FavouriteProductsView(LoginRequiredMixin, ListView):
 
     def get_queryset(self):
         user = self.request.user
-        favs = FavoriteProducts.objects.filter(user=user)
-        products = [i.product for i in favs]
-        return products
+        return Product.objects.filter(favoriteproducts__user=user)
 
 
 def save_email(request):
     email = request.POST.get('email')
     user = request.user if request.user.is_authenticated else None
-    mail_users = Mail.objects.all()
     if user:
-        if email not in [i.mail for i in mail_users]:
-            Mail.objects.create(mail=email, user=user)
+        mail, created = Mail.objects.get_or_create(mail=email, defaults={'user': user})  # поиск по уникальному индексу
+        if created:
             messages.success(request, 'Ваша почта успешно сохранена')
         else:
             messages.warning(request, 'Ваша почта уже зарегистрированна')
@@ -196,55 +229,46 @@ def send_mail_to_customer(request):
     if superuser:
         if request.method == 'POST':
             text = request.POST.get('text')
-            mail_list = Mail.objects.all()
-            for email in mail_list:
-                mail = send_mail(
-                    subject='У нас новая акция',
-                    message=text,
-                    from_email=settings.EMAIL_HOST_USER,
-                    recipient_list=[email],
-                    fail_silently=False
-                )
-                print(f'Отправно ли сообщение на почту {email}? - {bool(mail)}')
+            campaign = queue_campaign(text)  # письма отправит воркер: manage.py send_campaigns
+            messages.success(request, f'Рассылка поставлена в очередь: {campaign.total} адресов')
+            return redirect('send_mail')
         else:
             pass
     else:
         return redirect('product_list')
 
-    return render(request, 'store/send_mail.html')
+    context = {
+        'campaigns': MailCampaign.objects.all()[:10]
+    }
+    return render(request, 'store/send_mail.html', context)
 
 # ---------------------------------------------------------------------------------------------
 
 
 #  Функция для страницы Корзины
 def cart(request):
-    if request.user.is_authenticated:
-        cart_info = get_cart_data(request)
-        context = {
-            'cart_total_quantity': cart_info['cart_total_quantity'],
-            'order': cart_info['order'],
-            'products': cart_info['products']
-        }
-
-        print(context)
-        return render(request, 'store/cart.html', context)
-    else:
-        messages.error(request, 'Авторизуйтесь или зарегистрируйтесь')
-        return redirect('login_registration')
+    cart_info = get_cart_data(request)
+    context = {
+        'cart_total_quantity': cart_info['cart_total_quantity'],
+        'order': cart_info['order'],
+        'products': cart_info['products']
+    }
+
+    return render(request, 'store/cart.html', context)
 
 
 #  Функция для добавления в корзину
 def to_cart(request, product_id, action):
-    if request.user.is_authenticated:
-        user_cart = CartForAuthenticatedUser(request, product_id, action)
-        next_page = request.META.get('HTTP_REFERER', 'product_list')
-        return redirect(next_page)
-    else:
-        messages.error(request, 'Авторизуйтесь или зарегистрируйтесь')
-        return redirect('login_registration')
+    get_cart(request, product_id, action)  # гость - корзина в cookie, пользователь - заказ в базе
+    next_page = request.META.get('HTTP_REFERER', 'product_list')
+    return redirect(next_page)
 
 
 def checkout(request):
+    if not request.user.is_authenticated:  # после входа корзина гостя перенесётся в заказ
+        messages.error(request, 'Авторизуйтесь или зарегистрируйтесь')
+        return redirect('login_registration')
+
     cart_info = get_cart_data(request)
 
     context = {
@@ -262,56 +286,76 @@ def checkout(request):
 
 
 def create_checkout_session(request):
-    stripe.api_key = settings.STRIPE_SECRET_KEY
-    if request.method == 'POST':
-        user_cart = CartForAuthenticatedUser(request)
-        cart_info = user_cart.get_cart_info()
-
-        customer_form = CustomerForm(data=request.POST)
-        if customer_form.is_valid():
-            customer = Customer.objects.get(user=request.user)
-            customer.first_name = customer_form.cleaned_data['first_name']
-            customer.last_name = customer_form.cleaned_data['last_name']
-            customer.save()
-            user = User.objects.get(username=request.user.username)
-            user.first_name = customer_form.cleaned_data['first_name']
-            user.last_name = customer_form.cleaned_data['last_name']
-            user.save()
-
-        shipping_form = ShippingForm(data=request.POST)
-        if shipping_form.is_valid():
-            address = shipping_form.save(commit=False)
-            address.customer = Customer.objects.get(user=request.user)
-            address.order = user_cart.get_cart_info()['order']
-            address.save()
-
-        total_price = cart_info['cart_total_price']
-        total_quantity = cart_info['cart_total_quantity']
-        session = stripe.checkout.Session.create(
-            line_items=[{
-                'price_data': {
-                    'currency': 'usd',
-                    'product_data':{
-                        'name': 'Товара с Тотембо'
-                    },
-                    'unit_amount': int(total_price * 100)
-                },
-                'quantity': 1
-            }],
-            mode='payment',
+    if request.method != 'POST' or not request.user.is_authenticated:
+        return redirect('checkout')
+
+    order = CartForAuthenticatedUser(request).get_order()
+    lines, total = get_cart_snapshot(order)  # один снимок корзины и для Stripe, и для проверки в вебхуке
+    if not lines:
+        messages.error(request, 'Корзина пуста')
+        return redirect('cart')
+
+    customer_form = CustomerForm(data=request.POST)
+    if customer_form.is_valid():
+        names = {'first_name': customer_form.cleaned_data['first_name'],
+                 'last_name': customer_form.cleaned_data['last_name']}
+        Customer.objects.filter(pk=order.customer_id).update(**names)
+        User.objects.filter(pk=request.user.pk).update(**names)
+
+    shipping_form = ShippingForm(data=request.POST)
+    if shipping_form.is_valid():
+        address = shipping_form.save(commit=False)
+        address.customer_id = order.customer_id
+        address.order = order
+        address.save()
+
+    try:
+        session = create_checkout_session_for_order(
+            order, lines, total,
             success_url=request.build_absolute_uri(reverse('success')),
-            cancel_url=request.build_absolute_uri(reverse('success'))
+            cancel_url=request.build_absolute_uri(reverse('checkout'))
         )
-        return redirect(session.url, 303)
+    except stripe.error.StripeError:  # сеть, ключ API или отказ Stripe - корзина остаётся, можно повторить
+        messages.error(request, 'Не удалось перейти к оплате. Попробуйте ещё раз')
+        return redirect('checkout')
+    response = redirect(session['url'])
+    response.status_code = 303  # Stripe просит 303 See Other после POST
+    return response
 
 
-def successPayment(request):
-    user_cart = CartForAuthenticatedUser(request)
-    user_cart.clear()
+def successPayment(request):  # корзину не чистим: заказ закроет вебхук после подтверждения оплаты
     messages.success(request, 'Оплата прошла успешно. Ожидайте заказ')
     return render(request, 'store/success.html')
 
 
+@csrf_exempt
+@require_POST
+def stripe_webhook(request):  # Stripe сообщает об оплате напрямую, подпись проверяем секретом вебхука
+    event = get_webhook_event(request.body, request.META.get('HTTP_STRIPE_SIGNATURE', ''))
+    if event is None:
+        return HttpResponse(status=400)
+    if event['type'] == 'checkout.session.completed':
+        fulfil_order(event['data']['object'])
+    return HttpResponse(status=200)
+
+
+@csrf_exempt
+@require_POST
+def stock_update(request):  # склад присылает остатки и цены пачкой: [{"slug": ..., "quantity": ..., "price": ...}]
+    if not check_token(request.headers.get('Authorization', '')):
+        return JsonResponse({'error': 'Неверный токен'}, status=401)
+    try:
+        items = json.loads(request.body)
+    except ValueError:
+        return JsonResponse({'error': 'Тело запроса - не JSON'}, status=400)
+    if isinstance(items, dict):
+        items = items.get('items')
+    if not isinstance(items, list) or len(items) > MAX_STOCK_UPDATES:
+        return JsonResponse({'error': f'Нужен список до {MAX_STOCK_UPDATES} строк'}, status=400)
+    results = apply_stock_updates(items)
+    return JsonResponse({'counts': count_results(results), 'results': results})
+
+
 
 
 